@@ -1,23 +1,44 @@
 from __future__ import annotations
 
+import asyncio
 import atexit
+import bisect
+import fcntl
+import functools
+import hashlib
+import heapq
+import itertools
+import json
+import math
+import mmap
 import os
+import queue
 import re
 import shlex
 import shutil
 import signal
 import site
+import socket
+import struct
 import sys
 import tempfile
 import termios
 import threading
+import time
 import traceback
 import typing as T
+from array import array
+from collections import OrderedDict
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures import wait as futures_wait
 from glob import glob
 from shutil import which
 from string import ascii_letters
 from subprocess import PIPE
 from subprocess import Popen
+from subprocess import SubprocessError
+from subprocess import run
 from types import ModuleType
 
 import gdb
@@ -48,12 +69,16 @@ except Exception:
 
 from prompt_toolkit import PromptSession
 from prompt_toolkit import print_formatted_text
+from prompt_toolkit.application import get_app
 from prompt_toolkit.application import run_in_terminal
-from prompt_toolkit.auto_suggest import AutoSuggestFromHistory
+from prompt_toolkit.auto_suggest import AutoSuggest
+from prompt_toolkit.auto_suggest import Suggestion
+from prompt_toolkit.buffer import Buffer
 from prompt_toolkit.completion import CompleteEvent
 from prompt_toolkit.completion import Completer
 from prompt_toolkit.completion import Completion
 from prompt_toolkit.document import Document
+from prompt_toolkit.filters import Condition
 from prompt_toolkit.formatted_text import ANSI
 from prompt_toolkit.formatted_text import FormattedText
 from prompt_toolkit.history import History
@@ -62,7 +87,9 @@ from prompt_toolkit.output import create_output
 from prompt_toolkit.shortcuts import CompleteStyle
 
 # global variables
-HAS_FZF = which("fzf") is not None
+# The path is resolved once, so opening a picker doesn't search PATH again
+FZF_PATH = which("fzf")
+HAS_FZF = FZF_PATH is not None
 MULTI_LINE_COMMANDS = {"commands", "if", "while", "py", "python", "define", "document"}
 # This sucks, but there's not a GDB API for checking dont-repeat now.
 # I just collect some common used commands which should not be repeated.
@@ -85,6 +112,13 @@ DONT_REPEAT: set[str] = {
     "gef",
     "tmux-setup",
 } | MULTI_LINE_COMMANDS
+# Commands which might define new GDB commands, the cached completions are dropped after running them.
+COMMAND_DEFINING_COMMANDS: set[str] = {
+    "source",
+    "alias",
+    "pi",
+    "python-interactive",
+} | MULTI_LINE_COMMANDS
 
 FZF_BASE_OPTS = (
     "--style=full",
@@ -99,6 +133,15 @@ FZF_BASE_OPTS = (
 )
 
 FZF_RUN_OPTS = FZF_BASE_OPTS + ("--select-1",)
+# The number of lines from the highlighted one whose previews are rendered in the background
+FZF_PREVIEW_PRERENDER_WINDOW = 32
+# The number of objfiles whose symbol names are demangled with one `c++filt` process
+SYMBOL_INDEX_DEMANGLE_BATCH_SIZE = 32
+# The cached symbol indexes smaller than this are read into memory instead of being memory-mapped, since
+# a mapping holds a duplicated file descriptor before Python 3.13
+SYMBOL_INDEX_MMAP_MIN_SIZE = 1024 * 1024
+# The seconds a worker thread waits for the main thread to run a function which uses the GDB API
+GDB_MAIN_THREAD_TIMEOUT = 5.0
 
 # Circle symbols for breakpoint status
 CIRCLE_ENABLED = "\u25cf"  # ● Filled circle
@@ -201,53 +244,1072 @@ def common_prefix(m: list[str]) -> str:
 
 if hasattr(gdb, "execute_mi"):  # This feature is only available in GDB 14.1 or later
 
-    def get_gdb_completes(query: str) -> list[str]:
-        return gdb.execute_mi("-complete", query)["matches"]  # ty: ignore[invalid-return-type]
+    def iter_query_gdb_completes(query: str) -> T.Iterator[tuple[list[str], bool]]:
+        """
+        Yield all possible completions of `query` chunk by chunk, with whether `max-completions` was reached.
+        """
+        result = gdb.execute_mi("-complete", query)
+        yield result["matches"], result.get("max_completions_reached") == "1"  # ty: ignore[invalid-yield]
 else:
 
-    def get_gdb_completes(query: str) -> list[str]:
+    def query_gdb_completes_of_empty_word(query: str, limit: int) -> tuple[list[str], bool]:
+        """
+        Return the completions of `query` which endswith whitespace with a single `complete` command.
+
+        GDB strips the trailing whitespace of the command we pass to `gdb.execute`, so we can't ask for
+        the completions of an empty word directly. But an opening quote works like an empty word for the
+        completers of symbols and filenames, e.g. `complete p '` gives us all symbols in one pass.
+        Note: The position of the quotes in the result might be different between completers, e.g.
+        (gdb) complete p 'm
+        p 'main
+        (gdb) complete b 'm
+        b main'
+        """
+        lines = gdb.execute(f"complete {query}'", to_string=True).splitlines()
+        truncated = len(lines) > limit
+        completions = []
+        for line in lines[:limit]:
+            if not line.startswith(query):
+                continue
+            completions.append(query + line[len(query) :].strip("'"))
+        return completions, truncated
+
+    def iter_query_gdb_completes(query: str) -> T.Iterator[tuple[list[str], bool]]:
+        """
+        Yield all possible completions of `query` chunk by chunk, with whether `max-completions` was reached.
+        """
         completions_limit = T.cast(int, gdb.parameter("max-completions"))
         if completions_limit == -1:
             completions_limit = 0xFFFFFFFF
         if completions_limit == 0:
-            return []
+            yield [], True
+            return
+        # Note: When the list is truncated, GDB prints an extra line to tell us max-completions is reached
         if query.strip() and query[-1].isspace():
-            # fuzzing all possible commands if the text before cursor endswith space
-            all_completions = []
+            completions, truncated = query_gdb_completes_of_empty_word(query, completions_limit)
+            if completions:
+                yield completions, truncated
+                return
+            # Other completers (e.g. the sub-commands of a prefix command) give us nothing for a quote,
+            # they don't walk through the symbol tables, so it's cheap to fuzz all possible first characters.
             for c in ascii_letters + "_-":
                 if completions_limit <= 0:
-                    break
-                completions = gdb.execute(f"complete {query + c}", to_string=True).splitlines()[
-                    :completions_limit
-                ]
-                all_completions.extend(completions)
+                    yield [], True
+                    return
+                completions = gdb.execute(f"complete {query + c}", to_string=True).splitlines()
+                if len(completions) > completions_limit:
+                    yield completions[:completions_limit], True
+                    return
+                yield completions, False
                 completions_limit -= len(completions)
+            return
+
+        completions = gdb.execute(f"complete {query}", to_string=True).splitlines()
+        if len(completions) > completions_limit:
+            yield completions[:completions_limit], True
         else:
-            all_completions = gdb.execute(f"complete {query}", to_string=True).splitlines()[
-                :completions_limit
+            yield completions, False
+
+
+def query_gdb_completes(query: str) -> tuple[list[str], bool]:
+    """
+    Return all possible completions of `query` and whether `max-completions` was reached.
+    """
+    all_completions: list[str] = []
+    truncated = False
+    for completions, truncated in iter_query_gdb_completes(query):
+        all_completions.extend(completions)
+    return all_completions, truncated
+
+
+class CompletionCache:
+    """
+    A bounded LRU cache for the results of `query_gdb_completes`.
+
+    The cache is dropped as a whole whenever something that GDB completes against might have changed,
+    e.g. objfiles are loaded/unloaded, or another frame is selected.
+    The completions of convenience variables are never cached, since any command might set one.
+    """
+
+    def __init__(self) -> None:
+        self._entries: OrderedDict[tuple[int, str], tuple[list[str], bool]] = OrderedDict()
+        # The pc of the selected frame when the cached completions were fetched
+        self._frame_pc: int | None = None
+        self.generation = 0
+        self.hits = 0
+        self.refinements = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def max_size(self) -> int:
+        return T.cast(int, gdb.parameter("completion-cache-size"))
+
+    @staticmethod
+    def is_cacheable(query: str) -> bool:
+        return re.search(r"\$\w*$", query) is None
+
+    def check_frame(self) -> None:
+        """
+        Drop the cached completions if another frame is selected, e.g. by `up`, `frame 2` or `thread 2`,
+        since the local variables of the selected frame are completed too.
+        """
+        try:
+            frame_pc = gdb.selected_frame().pc()
+        except gdb.error:
+            frame_pc = None
+        if frame_pc != self._frame_pc:
+            self._frame_pc = frame_pc
+            self.invalidate()
+
+    def get(self, query: str) -> list[str] | None:
+        if not self.is_cacheable(query):
+            self.misses += 1
+            return None
+        self.check_frame()
+        key = (T.cast(int, gdb.parameter("max-completions")), query)
+        entry = self._entries.get(key)
+        if entry is None:
+            completions = self.refine(query)
+            if completions is None:
+                self.misses += 1
+            else:
+                self.refinements += 1
+            return completions
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def refine(self, query: str) -> list[str] | None:
+        """
+        Narrow the cached completions of a shorter query which `query` extends, if there is one.
+
+        This only works when the extended part are word characters, e.g. `b ma` -> `b mal`, and the
+        cached result wasn't cut off by `max-completions`, otherwise GDB might give us a different list.
+        """
+        limit = T.cast(int, gdb.parameter("max-completions"))
+        end = len(query)
+        while end > 0 and (query[end - 1].isalnum() or query[end - 1] == "_"):
+            end -= 1
+            entry = self._entries.get((limit, query[:end]))
+            if entry is None:
+                continue
+            base_completions, truncated = entry
+            if truncated:
+                return None
+            base = query[:end]
+            word = re.split(r"\W+", query)[-1]
+            completions = [
+                completion
+                for completion in base_completions
+                if completion.startswith(query)
+                # GDB might also give us the scope-aware matches, e.g. `foo::B::func()` for `b fun`
+                or (not completion.startswith(base) and word in completion)
             ]
+            self.put(query, completions, False)
+            return completions
+        return None
+
+    def put(self, query: str, completions: list[str], truncated: bool) -> None:
+        max_size = self.max_size
+        if max_size == 0 or not self.is_cacheable(query):
+            return
+        key = (T.cast(int, gdb.parameter("max-completions")), query)
+        self._entries[key] = (completions, truncated)
+        self._entries.move_to_end(key)
+        while len(self._entries) > max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, *_: T.Any) -> None:
+        """
+        Drop all cached completions, this is also used as a callback of `gdb.events`.
+        """
+        self._entries.clear()
+        self.generation += 1
+
+
+COMPLETION_CACHE = CompletionCache()
+gdb.events.new_objfile.connect(COMPLETION_CACHE.invalidate)
+gdb.events.clear_objfiles.connect(COMPLETION_CACHE.invalidate)
+if hasattr(gdb.events, "free_objfile"):  # This event is only available in GDB 15.1 or later
+    gdb.events.free_objfile.connect(COMPLETION_CACHE.invalidate)
+# Local variables of the selected frame are completed too
+gdb.events.stop.connect(COMPLETION_CACHE.invalidate)
+
+
+def iter_gdb_completes(query: str) -> T.Iterator[list[str]]:
+    """
+    Yield all possible completions of `query` chunk by chunk, use the cached result if possible.
+
+    The result is cached only if all chunks are consumed.
+    """
+    symbol_completions = complete_symbols(query)
+    if symbol_completions is not None:
+        if symbol_completions[0]:
+            yield symbol_completions[0]
+        return
+    cached_completions = COMPLETION_CACHE.get(query)
+    if cached_completions is not None:
+        if cached_completions:
+            yield cached_completions.copy()
+        return
+    all_completions: list[str] = []
+    truncated = False
+    for completions, truncated in iter_query_gdb_completes(query):
+        if completions:
+            all_completions.extend(completions)
+            yield completions
+    COMPLETION_CACHE.put(query, all_completions, truncated)
+
+
+def get_gdb_completes(query: str) -> list[str]:
+    """
+    Return all possible completions of `query`, use the cached result if possible.
+    """
+    return list(itertools.chain.from_iterable(iter_gdb_completes(query)))
+
+
+def get_cache_directory() -> str:
+    """
+    Return the directory for GEP's persistent caches.
+    """
+    custom_cache_dir = T.cast(str, gdb.parameter("gep-cache-directory"))
+    if custom_cache_dir:
+        return os.path.expanduser(custom_cache_dir)
+    xdg_cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(xdg_cache_home, "gep")
+
 
-        return all_completions
+def get_loaded_python_extensions() -> list[str]:
+    """
+    Return the names of loaded top-level Python packages which are not from the standard library, GDB or GEP.
+
+    This is used to tell the different setups of GDB (e.g. with pwndbg or not) apart.
+    """
+    excluded_dirs = tuple(
+        os.path.realpath(path)
+        for path in (sys.base_prefix, sys.prefix, getattr(gdb, "PYTHONDIR", ""), directory)
+        if path
+    )
+    extensions = set()
+    for name, module in list(sys.modules.items()):
+        if "." in name or name == "__main__":
+            continue
+        module_file = getattr(module, "__file__", None)
+        if not module_file or os.path.realpath(module_file).startswith(excluded_dirs):
+            continue
+        extensions.add(name)
+    return sorted(extensions)
+
+
+class HelpDocsIndex:
+    """
+    An index of the GDB command tree and the help docs of each command.
+
+    The command tree is parsed from the output of `help all`, and the help docs of a command are fetched with
+    `help <command>` only once, then saved to the disk with the index. The help docs are fetched again if
+    the summary of the command in `help all` changed, or the command is redefined by `define` or
+    `document`.
+    The index file is keyed by the GDB version and the loaded Python extensions, since they might add or
+    override commands.
+    """
+
+    def __init__(self) -> None:
+        # Full name or alias of a command -> Full name of the command
+        self._aliases: dict[str, str] = {}
+        # Full name of a command -> The summary of the command in `help all`
+        self._summaries: dict[str, str] = {}
+        # Full name of a command -> Help docs of the command
+        self._docs: dict[str, str] = {}
+        self._is_stale = True
+        self._is_loaded = False
+        self._is_dirty = False
+        self._path: str | None = None
+
+    @property
+    def path(self) -> str:
+        if self._path is None:
+            key = "\n".join([gdb.VERSION] + get_loaded_python_extensions())
+            digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+            self._path = os.path.join(get_cache_directory(), f"help-index-{digest}.json")
+        return self._path
+
+    def load(self) -> None:
+        self._is_loaded = True
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+            self._aliases = data["aliases"]
+            self._summaries = data.get("summaries", {})
+            self._docs = data["docs"]
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print_warning(f"Failed to read help docs index: {e}")
+
+    def save(self) -> None:
+        if not self._is_dirty:
+            return
+        path = self.path
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".help-index-")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(
+                    {"aliases": self._aliases, "summaries": self._summaries, "docs": self._docs}, f
+                )
+            os.replace(tmp_path, path)
+            self._is_dirty = False
+        except Exception as e:
+            print_warning(f"Failed to write help docs index: {e}")
+
+    def mark_stale(self, full_cmd: str = "") -> None:
+        """
+        Re-check the command tree before the next lookup, this is called after running `full_cmd`, which
+        might define new GDB commands, the help docs of the command it defines or documents are dropped.
+        """
+        words = full_cmd.split("\n", 1)[0].split()
+        if len(words) >= 2 and words[0] in ("define", "document", "define-prefix"):
+            if not self._is_loaded:
+                self.load()
+            full_name = self._resolve(" ".join(words[1:]))
+            if self._docs.pop(full_name or "", None) is not None:
+                self._is_dirty = True
+        self._is_stale = True
+
+    def refresh(self) -> None:
+        """
+        Update the command tree with `help all`, the fetched help docs of existing commands are kept unless
+        their summaries changed.
+        """
+        if not self._is_loaded:
+            self.load()
+        aliases = {}
+        summaries = {}
+        for line in gdb.execute("help all", to_string=True).splitlines():
+            names, sep, summary = line.partition(" -- ")
+            if not sep or not names or names[0].isspace():
+                continue
+            # e.g. "info breakpoints, info b -- Status of specified breakpoints."
+            full_names = [" ".join(name.split()) for name in names.split(",")]
+            for name in full_names:
+                aliases[name] = full_names[0]
+            summaries[full_names[0]] = summary
+        if aliases != self._aliases or summaries != self._summaries:
+            self._docs = {
+                name: docs
+                for name, docs in self._docs.items()
+                if name in aliases and summaries.get(name) == self._summaries.get(name)
+            }
+            self._aliases = aliases
+            self._summaries = summaries
+            self._is_dirty = True
+        self._is_stale = False
+
+    def resolve(self, command: str) -> str | None:
+        """
+        Return the full name of `command`, or None if it's not a GDB command.
+
+        Aliases are resolved word by word, e.g. `i b` -> `info breakpoints`.
+        """
+        if self._is_stale:
+            self.refresh()
+        return self._resolve(command)
+
+    def _resolve(self, command: str) -> str | None:
+        full_name = ""
+        for word in command.split():
+            full_name = self._aliases.get(f"{full_name} {word}".lstrip(), "")
+            if not full_name:
+                return None
+        return full_name or None
+
+    def is_command(self, command: str) -> bool:
+        return self.resolve(command) is not None
+
+    def get_help_docs(self, command: str) -> str | None:
+        full_name = self.resolve(command)
+        if full_name is None:
+            return None
+        docs = self._docs.get(full_name)
+        if docs is None:
+            try:
+                docs = gdb.execute(f"help {full_name}", to_string=True).strip()
+            except gdb.error:
+                docs = ""
+            self._docs[full_name] = docs
+            self._is_dirty = True
+        return docs or None
+
+
+HELP_DOCS_INDEX = HelpDocsIndex()
+atexit.register(HELP_DOCS_INDEX.save)
 
 
 def safe_get_help_docs(command: str) -> str | None:
     """
-    A wrapper for gdb.execute('help <command>', to_string=True), but return None if gdb raise an exception.
+    Return the help docs of `command` from the help docs index, or None if it's not a GDB command.
+
+    This can be called from any thread, `help` always runs on the main thread.
+    """
+    return GDB_MAIN_THREAD.call(HELP_DOCS_INDEX.get_help_docs, command)
+
+
+def should_get_help_docs(completion: str) -> bool:
+    """
+    Check if we need to get help docs for the completions that generated by same command.
+    """
+    return GDB_MAIN_THREAD.call(HELP_DOCS_INDEX.is_command, completion)
+
+
+# Commands whose argument is a location, e.g. `break main`
+SYMBOL_LOCATION_COMMANDS = {"break", "tbreak", "info line"}
+# Commands whose argument is an expression, e.g. `print main`
+SYMBOL_EXPRESSION_COMMANDS = {"print", "x", "output", "call"}
+
+
+class MappedStrings(T.Sequence[str]):
+    """
+    A read-only sorted sequence of strings in a buffer, each string is decoded only when it's accessed.
+
+    The layout of the buffer is: count (uint32), offsets (uint32 * (count + 1)), blob (padded to 4 bytes),
+    and each string in the blob is terminated by a newline, so a substring search never spans two strings.
+    """
+
+    def __init__(self, buffer: T.Any, pos: int) -> None:
+        self._buffer = buffer
+        (count,) = struct.unpack_from("=I", buffer, pos)
+        offsets_start = pos + 4
+        self._blob_start = offsets_start + (count + 1) * 4
+        self._offsets = memoryview(buffer)[offsets_start : self._blob_start].cast("I")
+        self.end = self._blob_start + (self._offsets[count] + 3) // 4 * 4
+
+    @staticmethod
+    def pack(strings: T.Sequence[str]) -> bytes:
+        blob = bytearray()
+        offsets = array("I", [0])
+        for string in strings:
+            blob += string.encode("utf-8", "surrogateescape") + b"\n"
+            offsets.append(len(blob))
+        blob += b"\0" * (-len(blob) % 4)
+        return struct.pack("=I", len(strings)) + offsets.tobytes() + bytes(blob)
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    @T.overload
+    def __getitem__(self, idx: int) -> str: ...
+
+    @T.overload
+    def __getitem__(self, idx: slice) -> list[str]: ...
+
+    def __getitem__(self, idx: int | slice) -> str | list[str]:
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("index out of range")
+        start = self._blob_start + self._offsets[idx]
+        end = self._blob_start + self._offsets[idx + 1] - 1
+        return str(self._buffer[start:end], "utf-8", "surrogateescape")
+
+    def find_all(self, substring: str) -> list[int]:
+        """
+        Return the indexes of the strings which contain `substring`.
+        """
+        needle = substring.encode("utf-8", "surrogateescape")
+        blob_end = self._blob_start + self._offsets[len(self)]
+        indexes = []
+        pos = self._buffer.find(needle, self._blob_start, blob_end)
+        while pos != -1:
+            idx = bisect.bisect_right(self._offsets, pos - self._blob_start) - 1
+            indexes.append(idx)
+            pos = self._buffer.find(needle, self._blob_start + self._offsets[idx + 1], blob_end)
+        return indexes
+
+
+class SymbolIndex:
+    """
+    An in-process index of symbol names for completing locations and expressions.
+
+    The names are kept in sorted lists so prefix lookups are done with bisect, and the unqualified parts of
+    C++/Rust names (e.g. `B::func()` and `func()` of `foo::B::func()`) are indexed too, so `fun` matches them.
+
+    All lists are stored in a flat buffer, so the index can be saved and memory-mapped as is.
+    """
+
+    MAGIC = b"GEPSYM\x00\x01"
+
+    def __init__(self, buffer: T.Any) -> None:
+        if buffer[: len(self.MAGIC)] != self.MAGIC:
+            raise ValueError("Invalid symbol index")
+        self._buffer = buffer
+        self.names = MappedStrings(buffer, len(self.MAGIC))
+        self.filenames = MappedStrings(buffer, self.names.end)
+        # The unqualified parts of the names, and the index of their names
+        self._scoped_parts = MappedStrings(buffer, self.filenames.end)
+        self._scoped_name_indexes = memoryview(buffer)[self._scoped_parts.end :].cast("I")
+
+    @classmethod
+    def build(cls, names: T.Iterable[str], filenames: T.Iterable[str] = ()) -> SymbolIndex:
+        sorted_names = sorted(set(names))
+        scoped_names = []
+        for idx, name in enumerate(sorted_names):
+            # Ignore the `::` inside the parameters, e.g. `foo(std::string)`
+            qualified_name = name.partition("(")[0]
+            start = qualified_name.find("::")
+            while start != -1:
+                scoped_names.append((name[start + 2 :], idx))
+                start = qualified_name.find("::", start + 2)
+        scoped_names.sort()
+        return cls(
+            cls.MAGIC
+            + MappedStrings.pack(sorted_names)
+            + MappedStrings.pack(sorted(set(filenames)))
+            + MappedStrings.pack([part for part, _ in scoped_names])
+            + array("I", [idx for _, idx in scoped_names]).tobytes()
+        )
+
+    def tobytes(self) -> bytes:
+        return bytes(self._buffer)
+
+    @property
+    def nbytes(self) -> int:
+        return len(self._buffer)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    @staticmethod
+    def _prefix_range(strings: T.Sequence[str], prefix: str) -> range:
+        # All strings which start with `prefix` are between `prefix` and `upper_bound`
+        upper_bound = prefix + "\U0010ffff"
+        return range(bisect.bisect_left(strings, prefix), bisect.bisect_left(strings, upper_bound))
+
+    def complete(self, word: str, *, with_filenames: bool = False) -> list[str]:
+        """
+        Return the sorted names which start with `word`, or whose unqualified part starts with `word`.
+        """
+        name_indexes = set(self._prefix_range(self.names, word))
+        for idx in self._prefix_range(self._scoped_parts, word):
+            name_indexes.add(self._scoped_name_indexes[idx])
+        matches = [self.names[idx] for idx in sorted(name_indexes)]
+        if with_filenames:
+            matches.extend(self.filenames[idx] for idx in self._prefix_range(self.filenames, word))
+            matches.sort()
+        return matches
+
+    def search(self, substring: str) -> list[str]:
+        """
+        Return the sorted names which contain `substring`.
+        """
+        return [self.names[idx] for idx in self.names.find_all(substring)]
+
+
+def get_objfile_identity(objfile: gdb.Objfile) -> str:
+    """
+    Return a string which identifies the content of an objfile, its build-id, or its path, mtime, and size.
+    """
+    if objfile.build_id:
+        # A separate debug file has the same build-id as the objfile it belongs to
+        return objfile.build_id if objfile.owner is None else f"{objfile.build_id}:debug"
+    filename = objfile.filename or ""
+    try:
+        st = os.stat(filename)
+    except OSError:
+        # e.g. "system-supplied DSO at 0x7ffff7fc1000"
+        return filename
+    return f"{os.path.realpath(filename)}:{st.st_mtime_ns}:{st.st_size}"
+
+
+# See https://refspecs.linuxfoundation.org/elf/gabi4+/ch4.sheader.html
+ELF_SHT_SYMTAB = 2
+ELF_SHT_DYNSYM = 11
+ELF_SHN_UNDEF = 0
+ELF_STT_FILE = 4
+# STT_OBJECT, STT_FUNC, STT_TLS, and STT_GNU_IFUNC
+ELF_SYMBOL_TYPES = {1, 2, 6, 10}
+
+
+def read_elf_symbols(path: str) -> tuple[list[str], list[str]]:
+    """
+    Read the names of the defined functions and variables, and the source filenames from the `.symtab`
+    and `.dynsym` of an ELF file.
+
+    This runs in the thread of `SymbolIndexer`, so it must not use the `gdb` module.
+    """
+    names = []
+    filenames = []
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as elf:
+        if elf[:4] != b"\x7fELF":
+            raise ValueError(f"{path} is not an ELF file")
+        endian = "<" if elf[5] == 1 else ">"
+        if elf[4] == 2:  # ELFCLASS64
+            (shoff,) = struct.unpack_from(endian + "Q", elf, 0x28)
+            shentsize, shnum = struct.unpack_from(endian + "HH", elf, 0x3A)
+            section_header = struct.Struct(endian + "IIQQQQIIQQ")
+            symbol = struct.Struct(endian + "IBBHQQ")
+            info_field, shndx_field = 1, 3
+        else:
+            (shoff,) = struct.unpack_from(endian + "I", elf, 0x20)
+            shentsize, shnum = struct.unpack_from(endian + "HH", elf, 0x2E)
+            section_header = struct.Struct(endian + "10I")
+            symbol = struct.Struct(endian + "IIIBBH")
+            info_field, shndx_field = 3, 5
+        sections = [section_header.unpack_from(elf, shoff + i * shentsize) for i in range(shnum)]
+        for _, sh_type, _, _, offset, size, link, _, _, entsize in sections:
+            if sh_type not in (ELF_SHT_SYMTAB, ELF_SHT_DYNSYM) or entsize != symbol.size:
+                continue
+            if link >= len(sections):
+                continue
+            strtab_start = sections[link][4]
+            strtab_end = strtab_start + sections[link][5]
+            for fields in symbol.iter_unpack(elf[offset : offset + size - size % entsize]):
+                sym_type = fields[info_field] & 0xF
+                if fields[0] == 0:
+                    continue
+                if sym_type != ELF_STT_FILE and (
+                    sym_type not in ELF_SYMBOL_TYPES or fields[shndx_field] == ELF_SHN_UNDEF
+                ):
+                    continue
+                name_start = strtab_start + fields[0]
+                name_end = elf.find(b"\0", name_start, strtab_end)
+                if name_end == -1:
+                    continue
+                name = str(elf[name_start:name_end], "utf-8", "surrogateescape")
+                if sym_type == ELF_STT_FILE:
+                    # Skip the objects without debug info, e.g. `Scrt1.o`
+                    if not name.endswith(".o"):
+                        filenames.append(os.path.basename(name))
+                else:
+                    # Drop the version of the symbol, e.g. `memcpy@@GLIBC_2.14` -> `memcpy`
+                    names.append(name.partition("@")[0])
+    return names, filenames
+
+
+class HelperProcessGuard:
+    """
+    Let the other threads run helper processes, e.g. `c++filt`, only while no inferior is running.
+
+    GDB reaps any child process with `waitpid(-1)` while the inferior is running, so a helper process must
+    exit before the inferior is resumed. `gdb.events.cont` is emitted on the main thread before GDB waits
+    for the inferior, and it waits there for the running helper process.
+    """
+
+    def __init__(self) -> None:
+        self._stopped = threading.Event()
+        self._stopped.set()
+        self._lock = threading.Lock()
+
+    def on_continue(self, _: T.Any) -> None:
+        with self._lock:
+            self._stopped.clear()
+
+    def on_stop(self, _: T.Any) -> None:
+        self._stopped.set()
+
+    def __enter__(self) -> HelperProcessGuard:
+        # Wait until no inferior is running, and keep it stopped until the context exits
+        if threading.current_thread() is threading.main_thread():
+            # GDB can't wait for the inferior before we return
+            self._lock.acquire()
+            return self
+        while True:
+            self._stopped.wait()
+            self._lock.acquire()
+            if self._stopped.is_set():
+                return self
+            self._lock.release()
+
+    def __exit__(self, *_: T.Any) -> None:
+        self._lock.release()
+
+
+HELPER_PROCESS_GUARD = HelperProcessGuard()
+gdb.events.cont.connect(HELPER_PROCESS_GUARD.on_continue)
+gdb.events.stop.connect(HELPER_PROCESS_GUARD.on_stop)
+gdb.events.exited.connect(HELPER_PROCESS_GUARD.on_stop)
+
+
+def demangle_symbol_names(names: list[str]) -> list[str]:
+    """
+    Demangle the names of C++ and Rust symbols with `c++filt`, the names are returned as is if it's not installed.
+
+    If an inferior is running, this waits until it stops, see `HelperProcessGuard`.
+    """
+    mangled_names = [name for name in names if name.startswith(("_Z", "_R"))]
+    if not mangled_names or not which("c++filt"):
+        return names
+    try:
+        with HELPER_PROCESS_GUARD:
+            # Run it in a new session, so pressing Ctrl-C in GDB doesn't kill it
+            p = Popen(
+                ["c++filt"],
+                stdin=PIPE,
+                stdout=PIPE,
+                text=True,
+                errors="surrogateescape",
+                start_new_session=True,
+            )
+            output, _ = p.communicate("\n".join(mangled_names) + "\n")
+    except OSError:
+        return names
+    demangled_names = dict(zip(mangled_names, output.splitlines()))
+    return [demangled_names.get(name, name) for name in names]
+
+
+def build_elf_symbol_index(path: str) -> SymbolIndex:
+    """
+    Return the `SymbolIndex` of an ELF file.
+    """
+    names, filenames = read_elf_symbols(path)
+    return SymbolIndex.build(demangle_symbol_names(sorted(set(names))), filenames)
+
+
+class SymbolIndexCache:
+    """
+    The on-disk cache of the symbol indexes of objfiles, the large indexes are memory-mapped when they are
+    loaded, see `SYMBOL_INDEX_MMAP_MIN_SIZE`.
+
+    The least recently used indexes are evicted when the total size exceeds `max_size` bytes.
+    The settings are passed in by the caller, so the cache can be used without touching GDB in other threads.
+    """
+
+    def __init__(self, directory: str, max_size: int) -> None:
+        self.directory = directory
+        self.max_size = max_size
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest() + ".idx")
+
+    def load(self, key: str) -> SymbolIndex | None:
+        if self.max_size == 0:
+            return None
+        path = self.path(key)
+        try:
+            with open(path, "rb") as f:
+                if sys.version_info >= (3, 13):
+                    buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ, trackfd=False)
+                elif os.fstat(f.fileno()).st_size < SYMBOL_INDEX_MMAP_MIN_SIZE:
+                    buffer = f.read()
+                else:
+                    buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                index = SymbolIndex(buffer)
+            # The mtime is used to find the least recently used indexes
+            os.utime(path)
+            return index
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            print_warning(f"Failed to read symbol index cache: {e}")
+            return None
+
+    def save(self, key: str, index: SymbolIndex) -> None:
+        if self.max_size == 0:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".symbols-")
+            with os.fdopen(fd, "wb") as f:
+                f.write(index.tobytes())
+            os.replace(tmp_path, self.path(key))
+            self.evict()
+        except OSError as e:
+            print_warning(f"Failed to write symbol index cache: {e}")
+
+    def evict(self) -> None:
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith(".idx"):
+                    st = entry.stat()
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            os.unlink(path)
+            total_size -= size
+
+
+class SymbolIndexer(threading.Thread):
+    """
+    Build the `SymbolIndex` shards of the objfiles in the background.
+
+    The objfiles which are not in the cache are read from their ELF files one by one in this thread, so a
+    program with hundreds of shared libraries doesn't block the prompt. GDB is never forked for this, a
+    forked GDB would inherit the ptrace state and the locks of the main thread.
+    """
+
+    def __init__(self, objfiles: list[tuple[str, str]], cache: SymbolIndexCache) -> None:
+        super().__init__(daemon=True)
+        # The filenames and the identities of the objfiles
+        self.objfiles = objfiles
+        self.cache = cache
+        # The filename, the identity, and the index of each objfile
+        self.shards: list[tuple[str, str, SymbolIndex]] = []
+
+    def run(self) -> None:
+        missing = []
+        for filename, key in self.objfiles:
+            index = self.cache.load(key)
+            if index is not None:
+                self.shards.append((filename, key, index))
+            elif os.path.isfile(filename):
+                missing.append((filename, key))
+            else:
+                # e.g. "system-supplied DSO at 0x7ffff7fc1000", GDB will complete its symbols
+                self.shards.append((filename, key, SymbolIndex.build([])))
+        for start in range(0, len(missing), SYMBOL_INDEX_DEMANGLE_BATCH_SIZE):
+            self._build_batch(missing[start : start + SYMBOL_INDEX_DEMANGLE_BATCH_SIZE])
+
+    def _build_batch(self, objfiles: list[tuple[str, str]]) -> None:
+        # The names of all objfiles in the batch are demangled with one `c++filt`
+        symbols: list[tuple[str, str, list[str], list[str]]] = []
+        for filename, key in objfiles:
+            try:
+                names, filenames = read_elf_symbols(filename)
+                symbols.append((filename, key, sorted(set(names)), filenames))
+            except (OSError, ValueError, struct.error):
+                # e.g. the objfile is not an ELF file, GDB will complete its symbols
+                self.shards.append((filename, key, SymbolIndex.build([])))
+        all_names = list(itertools.chain.from_iterable(names for _, _, names, _ in symbols))
+        demangled_names = iter(demangle_symbol_names(all_names))
+        for filename, key, names, filenames in symbols:
+            index = SymbolIndex.build(itertools.islice(demangled_names, len(names)), filenames)
+            self.cache.save(key, index)
+            self.shards.append((filename, key, index))
+
+
+def merge_sorted_unique(lists: T.Iterable[list[str]]) -> list[str]:
+    """
+    Merge the sorted lists into one sorted list without duplicates.
+    """
+    return [string for string, _ in itertools.groupby(heapq.merge(*lists))]
+
+
+class ShardedSymbolIndex:
+    """
+    A view of the `SymbolIndex` shards of all objfiles, the results of the shards are merged at query time.
+
+    `is_complete` is False if some objfiles don't have a shard yet, i.e. they are still being indexed.
+    """
+
+    def __init__(self, shards: T.Iterable[SymbolIndex], is_complete: bool = True) -> None:
+        self.shards = list(shards)
+        self.is_complete = is_complete
+
+    def __len__(self) -> int:
+        return sum(len(shard) for shard in self.shards)
+
+    def complete(self, word: str, *, with_filenames: bool = False) -> list[str]:
+        return merge_sorted_unique(
+            shard.complete(word, with_filenames=with_filenames) for shard in self.shards
+        )
+
+    def search(self, substring: str) -> list[str]:
+        return merge_sorted_unique(shard.search(substring) for shard in self.shards)
+
+
+class SymbolIndexManager:
+    """
+    Maintain a `SymbolIndex` shard for each objfile.
+
+    The shards are added and dropped one by one with `gdb.events`, so loading or unloading a shared library
+    only indexes that library, and the shards of the other objfiles stay warm.
+    """
+
+    def __init__(self) -> None:
+        # The identities of the loaded objfiles by their filenames, None if we need to rescan the objfiles
+        self._objfiles: dict[str, str] | None = None
+        self._shards: dict[str, SymbolIndex] = {}
+        self._indexer: SymbolIndexer | None = None
+        # The filenames of the shards which are taken from the indexer
+        self._collected: list[str] = []
+
+    def on_new_objfile(self, event: gdb.NewObjFileEvent) -> None:
+        objfile = event.new_objfile
+        if not objfile.filename:
+            return
+        # The objfile might be reloaded, e.g. the program is recompiled
+        self._shards.pop(objfile.filename, None)
+        if self._objfiles is not None:
+            self._objfiles[objfile.filename] = get_objfile_identity(objfile)
+
+    def on_free_objfile(self, event: gdb.FreeObjFileEvent) -> None:
+        filename = event.objfile.filename
+        if not filename:
+            return
+        self._shards.pop(filename, None)
+        if self._objfiles is not None:
+            self._objfiles.pop(filename, None)
+
+    def on_clear_objfiles(self, *_: T.Any) -> None:
+        self._objfiles = None
+        self._shards.clear()
+
+    def _collect_shards(self) -> None:
+        """
+        Take the shards which the indexer built so far, the indexer appends them one by one.
+        """
+        if self._indexer is None:
+            return
+        is_done = not self._indexer.is_alive()
+        for filename, key, index in self._indexer.shards[len(self._collected) :]:
+            self._collected.append(filename)
+            # Drop the shards of the objfiles which are changed or freed while indexing
+            if self._objfiles is not None and self._objfiles.get(filename) == key:
+                self._shards[filename] = index
+        if is_done:
+            self._indexer = None
+            self._collected.clear()
+
+    def start(self) -> None:
+        """
+        Start indexing the objfiles which don't have a shard yet.
+        """
+        self._collect_shards()
+        if self._indexer is not None:
+            return
+        if self._objfiles is None or not hasattr(gdb.events, "free_objfile"):
+            # Without `free_objfile` (before GDB 15.1), we can't tell which objfiles are unloaded
+            self._objfiles = {
+                objfile.filename: get_objfile_identity(objfile)
+                for objfile in gdb.objfiles()
+                if objfile.is_valid() and objfile.filename
+            }
+            for filename in self._shards.keys() - self._objfiles.keys():
+                del self._shards[filename]
+        missing = [
+            (filename, key)
+            for filename, key in self._objfiles.items()
+            if filename not in self._shards
+        ]
+        if not missing:
+            return
+        cache = SymbolIndexCache(
+            os.path.join(get_cache_directory(), "symbols"),
+            T.cast(int, gdb.parameter("symbol-cache-size")) * 1024 * 1024,
+        )
+        self._indexer = SymbolIndexer(missing, cache)
+        self._indexer.start()
+
+    @property
+    def index(self) -> ShardedSymbolIndex:
+        """
+        The index of the objfiles which are indexed already, so loading a shared library doesn't make the
+        shards of the other objfiles unavailable.
+        """
+        self.start()
+        return ShardedSymbolIndex(self._shards.values(), is_complete=self._indexer is None)
+
+    @property
+    def shards(self) -> list[SymbolIndex]:
+        return list(self._shards.values())
+
+
+SYMBOL_INDEX_MANAGER = SymbolIndexManager()
+gdb.events.new_objfile.connect(SYMBOL_INDEX_MANAGER.on_new_objfile)
+gdb.events.clear_objfiles.connect(SYMBOL_INDEX_MANAGER.on_clear_objfiles)
+if hasattr(gdb.events, "free_objfile"):  # This event is only available in GDB 15.1 or later
+    gdb.events.free_objfile.connect(SYMBOL_INDEX_MANAGER.on_free_objfile)
+
+
+def get_frame_symbol_names() -> list[str]:
     """
+    Return the names of the local variables and arguments visible in the selected frame.
+    """
+    names = []
     try:
-        return gdb.execute(f"help {command}", to_string=True).strip()
-    except gdb.error:
+        block = gdb.selected_frame().block()
+    except (gdb.error, RuntimeError):
+        return names
+    while block is not None and not block.is_global and not block.is_static:
+        for symbol in block:
+            if symbol.is_variable or symbol.is_argument:
+                names.append(symbol.name)
+        block = block.superblock
+    return names
+
+
+def split_symbol_completion_query(query: str) -> tuple[str, str, bool] | None:
+    """
+    Split the query into the text before the symbol, the symbol to complete, and whether it's a location.
+
+    Return None if the query is not for a symbol, e.g. `b file.c:10`, `p foo.bar`, `p 'quoted`, or `info `.
+    """
+    match = re.match(r"(?P<command>[^\s/]+)(?:/\S*)?\s+(?P<args>.*)$", query, re.DOTALL)
+    if match is None:
+        return None
+    command = HELP_DOCS_INDEX.resolve(match["command"])
+    args = match["args"]
+    if command == "info":
+        match = re.match(r"(?P<subcommand>\S+)\s+(?P<args>.*)$", args, re.DOTALL)
+        if match is None:
+            return None
+        command = HELP_DOCS_INDEX.resolve(f"info {match['subcommand']}")
+        args = match["args"]
+    if command in SYMBOL_LOCATION_COMMANDS:
+        if not re.fullmatch(r"[A-Za-z_~][\w:~]*", args):
+            return None
+        word = args
+        is_location = True
+    elif command in SYMBOL_EXPRESSION_COMMANDS:
+        match = re.search(r"(?<![\w$.>:'\"])[A-Za-z_~][\w:~]*$", args)
+        if match is None:
+            return None
+        word = match[0]
+        is_location = False
+    else:
         return None
+    return query[: len(query) - len(word)], word, is_location
 
 
-def should_get_help_docs(completion: str) -> bool:
+def complete_symbols(query: str) -> tuple[list[str], bool] | None:
     """
-    Check if we need to get help docs for another completion that generated by same command.
+    Complete the symbol at the end of `query` with the symbol index, or None if GDB should complete it.
+
+    Return the completions and whether `max-completions` was reached.
     """
-    if " " not in completion.strip():
-        return True
-    parent_command, _ = completion.rsplit(maxsplit=1)
-    return safe_get_help_docs(parent_command) != safe_get_help_docs(completion)
+    if not gdb.parameter("symbol-index"):
+        return None
+    split_query = split_symbol_completion_query(query)
+    if split_query is None:
+        return None
+    head, word, is_location = split_query
+    index = SYMBOL_INDEX_MANAGER.index
+
+    def is_expression(name: str) -> bool:
+        # The ELF local symbols, e.g. `calls.0` of a static variable, are not valid expressions
+        return "." not in name
+
+    matches = index.complete(word, with_filenames=is_location)
+    if not is_location:
+        matches = list(filter(is_expression, matches))
+        local_matches = {name for name in get_frame_symbol_names() if name.startswith(word)}
+        if local_matches:
+            matches = sorted(local_matches.union(matches))
+    gdb_completions: list[str] = []
+    if not index.is_complete or (not matches and not is_location):
+        # Some objfiles are still being indexed, or the word is not an ELF symbol, e.g. an enumerator,
+        # a typedef, a struct tag, or a macro, GDB knows them
+        gdb_completions, _ = query_gdb_completes(query)
+    if not matches and not gdb_completions and word:
+        # Nothing starts with the word, the names which contain it are better than nothing
+        matches = index.search(word)
+        if not is_location:
+            matches = list(filter(is_expression, matches))
+    completions = [head + match for match in matches]
+    if gdb_completions:
+        completions = sorted(set(completions).union(gdb_completions))
+    limit = T.cast(int, gdb.parameter("max-completions"))
+    truncated = 0 <= limit < len(completions)
+    if truncated:
+        completions = completions[:limit]
+    return completions, truncated
 
 
 def get_gdb_completion_and_status(query: str) -> tuple[list[str], bool]:
@@ -278,7 +1340,7 @@ def create_fzf_process(
         use_select_1: If True, use --select-1 to auto-select when only one match.
         extra_opts: Additional fzf options to append to the command.
     """
-    if not HAS_FZF:
+    if FZF_PATH is None:
         raise ValueError("fzf is not installed")
     if query.startswith("!"):
         # ! in the beginning of query means we want to run the command directly for fzf
@@ -290,7 +1352,7 @@ def create_fzf_process(
         run_opts = FZF_RUN_OPTS
     else:
         run_opts = FZF_BASE_OPTS
-    cmd = ("fzf",) + run_opts + extra_opts + ("--query", query)
+    cmd = (FZF_PATH,) + run_opts + extra_opts + ("--query", query)
     if preview:
         custom_preview_opts: str = gdb.parameter("fzf-preview-opts")  # ty: ignore[invalid-assignment]
         preview_opts = (
@@ -303,37 +1365,477 @@ def create_fzf_process(
     return Popen(cmd, stdin=PIPE, stdout=PIPE, text=True, encoding="utf-8")
 
 
-def create_preview_fifos() -> tuple[str, str]:
+class GDBMainThreadExecutor:
     """
-    Create a temporary directory and two FIFOs in it, return the paths of these FIFOs.
+    Run the functions which use the GDB API on the main thread of GDB for the other threads, since the
+    GDB API is not thread-safe.
 
-    This is modified from:
-    https://github.com/infokiller/config-public/blob/652b4638a0a0ffed9743fa9e0ad2a8d4e4e90572/.config/ipython/profile_default/startup/ext/fzf_history.py#L128
+    A submitted function runs when the prompt is waiting for input, when the main thread is waiting in
+    `run_in_worker`, e.g. for fzf to exit, or otherwise when GDB runs its event loop, e.g. while the
+    inferior is running, see `gdb.post_event`.
     """
-    fifo_dir = tempfile.mkdtemp(prefix="gep_tab_fzf_")
-    fifo_input_path = os.path.join(fifo_dir, "input")
-    fifo_output_path = os.path.join(fifo_dir, "output")
-    os.mkfifo(fifo_input_path)
-    os.mkfifo(fifo_output_path)
-    atexit.register(shutil.rmtree, fifo_dir)
-    return fifo_input_path, fifo_output_path
 
+    def __init__(self) -> None:
+        # None only wakes up `run_in_worker`
+        self._tasks: queue.SimpleQueue[tuple[T.Callable[[], T.Any], Future] | None] = (
+            queue.SimpleQueue()
+        )
+        # Guards `_loop` and `_workers`, so a submitted function is never left in the queue by the
+        # main thread which stops serving it
+        self._lock = threading.Lock()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._workers = 0
 
-def fzf_reverse_search(event: KeyPressEvent) -> None:
-    """Reverse search history with fzf."""
-
-    def _fzf_reverse_search() -> None:
-        # run_in_terminal will hide the prompt, we show the prompt while running fzf
-        # so user can see the original prompt while selecting completions, which is more user-friendly
-        event.app.renderer.render(event.app, event.app.layout, is_done=True)
+    def submit(self, fn: T.Callable[..., T.Any], *args: T.Any) -> Future:
+        """
+        Run `fn(*args)` on the main thread, return the future of its result.
+        """
+        future: Future = Future()
+        if threading.current_thread() is threading.main_thread():
+            self._run(functools.partial(fn, *args), future)
+            return future
+        with self._lock:
+            self._tasks.put((functools.partial(fn, *args), future))
+            if self._workers:
+                # `run_in_worker` takes it from the queue
+                return future
+            if self._loop is not None:
+                try:
+                    self._loop.call_soon_threadsafe(self.run_pending)
+                    return future
+                except RuntimeError:
+                    # The prompt returned already, and its event loop is closed
+                    pass
+        gdb.post_event(self.run_pending)
+        return future
+
+    def call(
+        self, fn: T.Callable[..., T.Any], *args: T.Any, timeout: float = GDB_MAIN_THREAD_TIMEOUT
+    ) -> T.Any:
+        """
+        Run `fn(*args)` on the main thread and return its result, `FutureTimeoutError` is raised if the
+        main thread is busy for more than `timeout` seconds, and `fn` won't run then.
+        """
+        future = self.submit(fn, *args)
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise
 
-        p = create_fzf_process(event.app.current_buffer.document.text_before_cursor)
-        visited = set()
-        for cmd in reversed(event.app.current_buffer.history.get_strings()):
-            if cmd and cmd not in visited:
-                visited.add(cmd)
-                p.stdin.write(cmd + "\n")  # ty: ignore[unresolved-attribute]
-        stdout, _ = p.communicate()
+    def prompt(self, session: PromptSession, *args: T.Any, **kwargs: T.Any) -> str:
+        """
+        Run `session.prompt(*args, **kwargs)`, the functions submitted meanwhile run in its event loop.
+        """
+        try:
+            return session.prompt(*args, pre_run=self._bind_event_loop, **kwargs)
+        finally:
+            with self._lock:
+                self._loop = None
+            # The event loop may have stopped before running them
+            self.run_pending()
+
+    def _bind_event_loop(self) -> None:
+        with self._lock:
+            self._loop = asyncio.get_running_loop()
+        self.run_pending()
+
+    def run_pending(self) -> None:
+        while True:
+            try:
+                task = self._tasks.get_nowait()
+            except queue.Empty:
+                return
+            if task is not None:
+                self._run(*task)
+
+    def run_in_worker(
+        self,
+        fn: T.Callable[..., T.Any],
+        *args: T.Any,
+        on_interrupt: T.Callable[[], T.Any] | None = None,
+    ) -> T.Any:
+        """
+        Run `fn(*args)` in a new thread and return its result, the functions submitted meanwhile run on
+        this thread.
+
+        If the wait is interrupted, e.g. by Ctrl-C, `on_interrupt` is called to make `fn` return, e.g. by
+        killing the process it waits for, so the thread is never left behind.
+        """
+        future: Future = Future()
+
+        def worker() -> None:
+            try:
+                future.set_result(fn(*args))
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                self._tasks.put(None)
+
+        with self._lock:
+            self._workers += 1
+        try:
+            threading.Thread(target=worker, daemon=True).start()
+            while not future.done():
+                try:
+                    task = self._tasks.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if task is not None:
+                    self._run(*task)
+        except BaseException:
+            if on_interrupt is not None:
+                on_interrupt()
+                futures_wait((future,), GDB_MAIN_THREAD_TIMEOUT)
+            raise
+        finally:
+            with self._lock:
+                self._workers -= 1
+            self.run_pending()
+        return future.result()
+
+    @staticmethod
+    def _run(fn: T.Callable[[], T.Any], future: Future) -> None:
+        if not future.set_running_or_notify_cancel():
+            # The caller gave up waiting
+            return
+        try:
+            future.set_result(fn())
+        except BaseException as e:
+            future.set_exception(e)
+            if not isinstance(e, Exception):
+                # e.g. KeyboardInterrupt, the caller gets it too, but the main thread stops here
+                raise
+
+
+GDB_MAIN_THREAD = GDBMainThreadExecutor()
+
+
+FZF_PREVIEW_CLIENT_SCRIPT = """import socket, sys
+client = socket.socket(socket.AF_UNIX)
+client.connect(sys.argv[1])
+client.sendall(("%s %s\\n" % (sys.argv[2], sys.argv[3])).encode("utf-8", "surrogateescape"))
+while data := client.recv(65536):
+    sys.stdout.buffer.write(data)
+"""
+
+
+class FzfPreviewPicker:
+    """
+    A fzf picker which gets its previews from `FzfPreviewServer`.
+
+    The previews are written to files in `preview_dir`, one file per line of fzf named by its index,
+    so a preview which is rendered already is only a `cat` for fzf.
+    """
+
+    def __init__(self, server: FzfPreviewServer, picker_id: int, preview_dir: str) -> None:
+        self.server = server
+        self.picker_id = picker_id
+        self.preview_dir = preview_dir
+        self.render: T.Callable[[str], str | None] | None = None
+        self.items: T.Sequence[str] = ()
+        # The number of requests from fzf which are waiting for their previews
+        self.waiting_requests = 0
+        # The index of the line which is requested last, and the indexes of the rendered previews
+        self.cursor = 0
+        self.rendered: set[int] = set()
+
+    def command(self) -> str:
+        """
+        Return the preview command for fzf.
+        """
+        preview_path = shlex.quote(self.preview_dir) + "/{n}"
+        client_cmd = self.server.get_client_command(self.picker_id, "{n}")
+        return f"cat {preview_path} 2>/dev/null || {client_cmd}"
+
+    def start(self, render: T.Callable[[str], str | None], items: T.Sequence[str]) -> None:
+        """
+        Start rendering the previews, `render(items[n])` is the preview of the n-th line of fzf.
+
+        The requests from fzf wait until then, and the previews after the highlighted line are rendered
+        in the background meanwhile.
+        """
+        self.server.start_picker(self, render, items)
+
+    def __enter__(self) -> FzfPreviewPicker:
+        return self
+
+    def __exit__(self, *_: T.Any) -> None:
+        self.server.close_picker(self)
+
+
+class FzfPreviewServer:
+    """
+    A server on a Unix domain socket which renders the previews of all fzf pickers.
+
+    The previews of the `FZF_PREVIEW_PRERENDER_WINDOW` lines from the highlighted one are rendered in the
+    background while fzf is running, fzf reads them from files without calling us. For the other lines,
+    fzf sends the picker id and the index of the line to the server and prints the reply, and the window
+    follows it. Rendering only a window keeps a long list from running a GDB command per line. Each connection is handled by its
+    own thread, so a slow preview doesn't block the next request, but the previews are rendered one at a
+    time on the main thread by `GDB_MAIN_THREAD`, since the GDB API is not thread-safe, and the requests
+    go before the background rendering. A request is dropped without a reply if a newer request of the
+    same picker arrives before it's rendered, so moving quickly through the candidates only renders
+    where the cursor stops.
+
+    One server is shared by all pickers of the session, see `get_shared`, and the files of a picker are
+    removed when it's closed.
+    """
+
+    _shared: T.ClassVar[FzfPreviewServer | None] = None
+
+    def __init__(self) -> None:
+        self._dir = tempfile.mkdtemp(prefix="gep_fzf_preview_")
+        self.socket_path = os.path.join(self._dir, "socket")
+        self._socket = socket.socket(socket.AF_UNIX)
+        self._socket.bind(self.socket_path)
+        self._socket.listen(16)
+        self._pickers: dict[int, FzfPreviewPicker] = {}
+        self._latest_requests: dict[int, int] = {}
+        self._next_picker_id = itertools.count(1)
+        self._next_request_id = itertools.count(1)
+        self._condition = threading.Condition()
+        self._render_lock = threading.Lock()
+        self._client = self._find_client()
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    @classmethod
+    def get_shared(cls) -> FzfPreviewServer:
+        """
+        Return the server shared by all pickers, it's started by the first picker, and restarted if its
+        socket was removed, e.g. by a cleaner of the temporary directory during a long session.
+        """
+        server = cls._shared
+        if server is None or not os.path.exists(server.socket_path):
+            if server is not None:
+                server.close()
+            server = cls._shared = cls()
+        return server
+
+    @classmethod
+    def close_shared(cls) -> None:
+        if cls._shared is not None:
+            cls._shared.close()
+            cls._shared = None
+
+    def close(self) -> None:
+        try:
+            # Wake up the thread which is waiting in accept()
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._socket.close()
+        shutil.rmtree(self._dir, ignore_errors=True)
+
+    @staticmethod
+    def _find_client() -> str:
+        """
+        Return the command which sends a request from stdin to the socket and prints the reply.
+
+        A POSIX shell can't talk to a Unix socket by itself, so we prefer socat, then a netcat which
+        supports Unix sockets, e.g. OpenBSD netcat or ncat. Starting python3 for each preview is the last
+        resort, it's much slower.
+        """
+        socat = shutil.which("socat")
+        if socat:
+            # socat waits at most -t seconds for the reply after sending the request
+            return f"{shlex.quote(socat)} -t 3600 - UNIX-CONNECT:"
+        for name in ("nc", "ncat"):
+            nc = shutil.which(name)
+            if not nc:
+                continue
+            try:
+                usage = run([nc, "-h"], capture_output=True, timeout=1)
+            except (OSError, SubprocessError):
+                continue
+            if b"-U" in usage.stdout + usage.stderr:
+                # The server closes the connection after replying, so netcat exits then
+                return f"{shlex.quote(nc)} -U "
+        return ""
+
+    def get_client_command(self, picker_id: int, field: str) -> str:
+        socket_path = shlex.quote(self.socket_path)
+        if self._client:
+            return f"printf '%s %s\\n' {picker_id} {field} | {self._client}{socket_path}"
+        python = shlex.quote(shutil.which("python3") or sys.executable)
+        script = shlex.quote(FZF_PREVIEW_CLIENT_SCRIPT)
+        return f"{python} -I -S -c {script} {socket_path} {picker_id} {field}"
+
+    def open_picker(self) -> FzfPreviewPicker:
+        with self._condition:
+            picker_id = next(self._next_picker_id)
+            preview_dir = os.path.join(self._dir, str(picker_id))
+            os.mkdir(preview_dir)
+            picker = self._pickers[picker_id] = FzfPreviewPicker(self, picker_id, preview_dir)
+        return picker
+
+    def start_picker(
+        self,
+        picker: FzfPreviewPicker,
+        render: T.Callable[[str], str | None],
+        items: T.Sequence[str],
+    ) -> None:
+        with self._condition:
+            picker.render = render
+            picker.items = items
+            self._condition.notify_all()
+        threading.Thread(target=self._prerender, args=(picker,), daemon=True).start()
+
+    def close_picker(self, picker: FzfPreviewPicker) -> None:
+        with self._condition:
+            self._pickers.pop(picker.picker_id, None)
+            self._latest_requests.pop(picker.picker_id, None)
+            self._condition.notify_all()
+        shutil.rmtree(picker.preview_dir, ignore_errors=True)
+
+    def _is_open(self, picker: FzfPreviewPicker) -> bool:
+        return self._pickers.get(picker.picker_id) is picker
+
+    def _render_preview(
+        self, picker: FzfPreviewPicker, idx: int, request_id: int | None = None
+    ) -> str | None:
+        """
+        Render the preview of the `idx`-th line and write it to its file, return None if the picker
+        was closed, or the request of `request_id` is outdated.
+        """
+        with self._render_lock:
+            with self._condition:
+                if not self._is_open(picker):
+                    return None
+                if (
+                    request_id is not None
+                    and self._latest_requests.get(picker.picker_id) != request_id
+                ):
+                    # The selection moved on
+                    return None
+            path = os.path.join(picker.preview_dir, str(idx))
+            try:
+                with open(path, encoding="utf-8") as f:
+                    return f.read()
+            except OSError:
+                pass
+            preview = ""
+            if picker.render is not None and 0 <= idx < len(picker.items):
+                try:
+                    preview = GDB_MAIN_THREAD.call(picker.render, picker.items[idx]) or ""
+                except FutureTimeoutError:
+                    # GDB is busy, don't keep an empty preview
+                    return None
+            try:
+                with open(path + ".tmp", "w", encoding="utf-8", errors="replace") as f:
+                    f.write(preview)
+                # Rename it, so fzf never reads a partial preview
+                os.replace(path + ".tmp", path)
+            except OSError:
+                # The picker was closed and its directory was removed
+                pass
+            with self._condition:
+                picker.rendered.add(idx)
+            return preview
+
+    def _next_prerender(self, picker: FzfPreviewPicker) -> int | None:
+        """
+        Return the first line in the window from the last requested line whose preview isn't rendered.
+        """
+        end = min(picker.cursor + FZF_PREVIEW_PRERENDER_WINDOW, len(picker.items))
+        for idx in range(picker.cursor, end):
+            if idx not in picker.rendered:
+                return idx
+        return None
+
+    def _prerender(self, picker: FzfPreviewPicker) -> None:
+        while True:
+            with self._condition:
+                # The requests from fzf go first
+                self._condition.wait_for(
+                    lambda: (
+                        not self._is_open(picker)
+                        or (
+                            not picker.waiting_requests and self._next_prerender(picker) is not None
+                        )
+                    )
+                )
+                idx = self._next_prerender(picker)
+                if not self._is_open(picker) or idx is None:
+                    return
+            if self._render_preview(picker, idx) is None:
+                return
+
+    def _serve(self) -> None:
+        while True:
+            try:
+                conn, _ = self._socket.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _handle(self, conn: socket.socket) -> None:
+        with conn:
+            # The request is a line, the clients might not shut down their side after sending it
+            request = b""
+            while b"\n" not in request and (data := conn.recv(65536)):
+                request += data
+            try:
+                picker_id_text, idx_text = request.decode("utf-8", "replace").split()
+                picker_id = int(picker_id_text)
+                idx = int(idx_text)
+            except ValueError:
+                return
+            with self._condition:
+                picker = self._pickers.get(picker_id)
+                if picker is None:
+                    return
+                request_id = next(self._next_request_id)
+                self._latest_requests[picker_id] = request_id
+                # Move the window of the background rendering
+                picker.cursor = idx
+                self._condition.notify_all()
+                self._condition.wait_for(
+                    lambda: picker.render is not None or not self._is_open(picker)
+                )
+                picker.waiting_requests += 1
+            try:
+                preview = self._render_preview(picker, idx, request_id)
+            finally:
+                with self._condition:
+                    picker.waiting_requests -= 1
+                    self._condition.notify_all()
+            if preview:
+                try:
+                    conn.sendall(preview.encode("utf-8", "replace"))
+                except OSError:
+                    # fzf killed the preview command already
+                    pass
+
+
+def stream_to_fzf(p: Popen, chunks: T.Iterable[list[str]]) -> None:
+    """
+    Write the lines to the stdin of fzf chunk by chunk, so fzf can render them while we are still producing.
+
+    We stop producing if fzf exited already, e.g. the user selected something before we wrote all lines.
+    """
+    for lines in chunks:
+        if not lines:
+            continue
+        try:
+            p.stdin.write("\n".join(lines) + "\n")  # ty: ignore[unresolved-attribute]
+            p.stdin.flush()  # ty: ignore[unresolved-attribute]
+        except BrokenPipeError:
+            return
+
+
+def fzf_reverse_search(event: KeyPressEvent) -> None:
+    """Reverse search history with fzf."""
+
+    def _fzf_reverse_search() -> None:
+        # run_in_terminal will hide the prompt, we show the prompt while running fzf
+        # so user can see the original prompt while selecting completions, which is more user-friendly
+        event.app.renderer.render(event.app, event.app.layout, is_done=True)
+
+        history = T.cast(GDBCommandsHistory, event.app.current_buffer.history)
+        p = create_fzf_process(event.app.current_buffer.document.text_before_cursor)
+        # Write all commands at once, fzf renders them while reading
+        stdout, _ = p.communicate(history.get_ranked_commands_text())
         if stdout:
             event.app.current_buffer.document = Document()  # clear buffer
             event.app.current_buffer.insert_text(stdout.strip())
@@ -354,15 +1856,20 @@ def fzf_tab_autocomplete(event: KeyPressEvent) -> None:
         target_text = (
             event.app.current_buffer.document.text_before_cursor.lstrip()
         )  # Ignore leading whitespaces
-        all_completions, should_get_all_help_docs = get_gdb_completion_and_status(target_text)
-        if not all_completions:
+        # The completions are streamed to fzf, we only wait for the first chunk to start fzf
+        chunks = iter_gdb_completes(target_text)
+        first_completions = next(chunks, None)
+        if not first_completions:
             return
+        should_get_all_help_docs = should_get_help_docs(first_completions[0])
 
         # run_in_terminal will hide the prompt, we show the prompt while running fzf
         # so user can see the original prompt while selecting completions, which is more user-friendly
         event.app.renderer.render(event.app, event.app.layout, is_done=True)
 
-        prefix = common_prefix([common_prefix(all_completions), target_text])
+        # Note: Only the chunks which are not from the cache or GDB 14.1+ might be more than one, and their
+        # completions always start with the target text, so the prefix won't be changed by the later chunks
+        prefix = common_prefix([common_prefix(first_completions), target_text])
         # TODO/FIXME: qeury might not be the expected one, e.g.
         # (gdb) complete b fun
         # b foo::B::func()
@@ -376,29 +1883,33 @@ def fzf_tab_autocomplete(event: KeyPressEvent) -> None:
             completion_idx = len(prefix) - len(query)
         else:
             completion_idx = 0
-        p = create_fzf_process(
-            query, FZF_PRVIEW_CMD if should_get_all_help_docs else None, use_select_1=True
-        )
-        completion_help_docs = {}
-        for i, completion in enumerate(all_completions):
-            if prefix.endswith("'" + query) and not completion.endswith("'"):
-                # This is a heuristic to fix the weird behavior of gdb's `complete` command:
-                # (gdb) complete p 'm
-                # ...
-                # p 'main
-                p.stdin.write(  # ty: ignore[unresolved-attribute]
-                    completion[completion_idx:] + "'" + "\n"
-                )
-            else:
-                p.stdin.write(  # ty: ignore[unresolved-attribute]
-                    completion[completion_idx:] + "\n"
-                )
+        all_completions: list[str] = []
+
+        def iter_fzf_lines() -> T.Iterator[list[str]]:
+            for completions in itertools.chain([first_completions], chunks):
+                all_completions.extend(completions)
+                lines = []
+                for completion in completions:
+                    if prefix.endswith("'" + query) and not completion.endswith("'"):
+                        # This is a heuristic to fix the weird behavior of gdb's `complete` command:
+                        # (gdb) complete p 'm
+                        # ...
+                        # p 'main
+                        lines.append(completion[completion_idx:] + "'")
+                    else:
+                        lines.append(completion[completion_idx:])
+                yield lines
+
+        with FzfPreviewServer.get_shared().open_picker() as picker:
+            p = create_fzf_process(
+                query, picker.command() if should_get_all_help_docs else None, use_select_1=True
+            )
+            stream_to_fzf(p, iter_fzf_lines())
+            # The help docs are fetched only when the completion is highlighted in fzf
+            # Note: We start the previews after streaming, so GDB is never used by two threads at once
             if should_get_all_help_docs:
-                completion_help_docs[i] = safe_get_help_docs(completion)
-        t = FzfTabCompletePreviewThread(FIFO_INPUT_PATH, FIFO_OUTPUT_PATH, completion_help_docs)
-        t.start()
-        stdout, _ = p.communicate()
-        t.stop()
+                picker.start(safe_get_help_docs, all_completions)
+            stdout, _ = GDB_MAIN_THREAD.run_in_worker(p.communicate, on_interrupt=p.kill)
         if stdout:
             # We might need to delete some characters before cursor if prefix + query != target_text
             event.app.current_buffer.delete_before_cursor(len(target_text) - len(prefix))
@@ -423,46 +1934,6 @@ def fzf_tab_autocomplete(event: KeyPressEvent) -> None:
     run_in_terminal(_fzf_tab_autocomplete)
 
 
-class FzfTabCompletePreviewThread(threading.Thread):
-    """
-    A thread for previewing help docs of selected completion with fzf.
-
-    This is modified from:
-    https://github.com/infokiller/config-public/blob/master/.config/ipython/profile_default/startup/ext/fzf_history.py#L72
-    """
-
-    def __init__(
-        self, fifo_input_path: str, fifo_output_path: str, completion_help_docs: dict, **kwargs
-    ) -> None:
-        super().__init__(**kwargs)
-        self.fifo_input_path = fifo_input_path
-        self.fifo_output_path = fifo_output_path
-        self.completion_help_docs = completion_help_docs
-        self.is_done = threading.Event()
-
-    def run(self) -> None:
-        while not self.is_done.is_set():
-            with open(self.fifo_input_path, encoding="utf-8") as fifo_input:
-                while not self.is_done.is_set():
-                    data = fifo_input.read()
-                    if len(data) == 0:
-                        break
-                    with open(self.fifo_output_path, "w", encoding="utf-8") as fifo_output:
-                        try:
-                            idx = int(data)
-                        except ValueError:
-                            continue
-                        help_doc = self.completion_help_docs.get(idx)
-                        if help_doc is not None:
-                            fifo_output.write(help_doc)
-
-    def stop(self) -> None:
-        self.is_done.set()
-        with open(self.fifo_input_path, "w", encoding="utf-8") as f:
-            f.close()
-        self.join()
-
-
 class BreakpointInfo:
     """Structured information about a GDB breakpoint."""
 
@@ -581,37 +2052,6 @@ def get_breakpoint_preview(bp_num: int) -> str:
     return "Breakpoint not found"
 
 
-class FzfBreakpointPreviewThread(threading.Thread):
-    """
-    A thread for previewing breakpoint details with fzf.
-    """
-
-    def __init__(self, fifo_input_path: str, fifo_output_path: str, **kwargs: T.Any) -> None:
-        super().__init__(**kwargs)
-        self.fifo_input_path = fifo_input_path
-        self.fifo_output_path = fifo_output_path
-        self.is_done = threading.Event()
-
-    def run(self) -> None:
-        while not self.is_done.is_set():
-            with open(self.fifo_input_path, encoding="utf-8") as fifo_input:
-                while not self.is_done.is_set():
-                    data = fifo_input.read()
-                    if len(data) == 0:
-                        break
-                    with open(self.fifo_output_path, "w", encoding="utf-8") as fifo_output:
-                        bp_num = parse_bp_number_from_fzf_output(data)
-                        if bp_num is not None:
-                            preview = get_breakpoint_preview(bp_num)
-                            fifo_output.write(preview)
-
-    def stop(self) -> None:
-        self.is_done.set()
-        with open(self.fifo_input_path, "w", encoding="utf-8") as f:
-            f.close()
-        self.join()
-
-
 def parse_bp_number_from_fzf_output(output: str) -> int | None:
     """
     Parse breakpoint number from fzf output.
@@ -630,6 +2070,13 @@ def parse_bp_number_from_fzf_output(output: str) -> int | None:
     return None
 
 
+def get_breakpoint_preview_from_fzf_output(output: str) -> str | None:
+    bp_num = parse_bp_number_from_fzf_output(output)
+    if bp_num is None:
+        return None
+    return get_breakpoint_preview(bp_num)
+
+
 def fzf_toggle_breakpoint(event: KeyPressEvent) -> None:
     """Toggle the enabled/disabled status of a breakpoint using fzf."""
 
@@ -642,28 +2089,25 @@ def fzf_toggle_breakpoint(event: KeyPressEvent) -> None:
         # Show prompt while running fzf
         event.app.renderer.render(event.app, event.app.layout, is_done=True)
 
-        # Create FIFOs for preview
-        fifo_input, fifo_output = create_preview_fifos()
-        preview_cmd = f"echo {{}} > {fifo_input}\ncat {fifo_output}"
-
-        # Use --nth to restrict search to NUM and LOCATION fields (skip circle)
-        p = create_fzf_process(
-            "",
-            preview_cmd,
-            use_select_1=False,
-            extra_opts=("--ansi", "--nth=2.."),
-        )
+        with FzfPreviewServer.get_shared().open_picker() as picker:
+            # Use --nth to restrict search to NUM and LOCATION fields (skip circle)
+            p = create_fzf_process(
+                "",
+                picker.command(),
+                use_select_1=False,
+                extra_opts=("--ansi", "--nth=2.."),
+            )
 
-        for bp in breakpoints:
-            if bp.number < 0:
-                continue
-            line = format_breakpoint_for_fzf(bp)
-            p.stdin.write(line + "\n")  # ty: ignore[unresolved-attribute]
+            lines = []
+            for bp in breakpoints:
+                if bp.number < 0:
+                    continue
+                line = format_breakpoint_for_fzf(bp)
+                lines.append(line)
+                p.stdin.write(line + "\n")  # ty: ignore[unresolved-attribute]
 
-        t = FzfBreakpointPreviewThread(fifo_input, fifo_output)
-        t.start()
-        stdout, _ = p.communicate()
-        t.stop()
+            picker.start(get_breakpoint_preview_from_fzf_output, lines)
+            stdout, _ = GDB_MAIN_THREAD.run_in_worker(p.communicate, on_interrupt=p.kill)
 
         if stdout:
             bp_num = parse_bp_number_from_fzf_output(stdout.strip())
@@ -683,129 +2127,1727 @@ def fzf_toggle_breakpoint(event: KeyPressEvent) -> None:
     run_in_terminal(_fzf_toggle_breakpoint)
 
 
-def fzf_delete_breakpoint(event: KeyPressEvent) -> None:
-    """Delete a breakpoint using fzf."""
+def fzf_delete_breakpoint(event: KeyPressEvent) -> None:
+    """Delete a breakpoint using fzf."""
+
+    def _fzf_delete_breakpoint() -> None:
+        breakpoints = gdb.breakpoints() or []
+        if not breakpoints:
+            print_warning("No breakpoints set.")
+            return
+
+        # Show prompt while running fzf
+        event.app.renderer.render(event.app, event.app.layout, is_done=True)
+
+        with FzfPreviewServer.get_shared().open_picker() as picker:
+            # Use --nth to restrict search to NUM and LOCATION fields (skip circle)
+            p = create_fzf_process(
+                "",
+                picker.command(),
+                use_select_1=False,
+                extra_opts=("--ansi", "--nth=2.."),
+            )
+
+            lines = []
+            for bp in breakpoints:
+                if bp.number < 0:
+                    continue
+                line = format_breakpoint_for_fzf(bp)
+                lines.append(line)
+                p.stdin.write(line + "\n")  # ty: ignore[unresolved-attribute]
+
+            picker.start(get_breakpoint_preview_from_fzf_output, lines)
+            stdout, _ = GDB_MAIN_THREAD.run_in_worker(p.communicate, on_interrupt=p.kill)
+
+        if stdout:
+            bp_num = parse_bp_number_from_fzf_output(stdout.strip())
+            if bp_num is not None:
+                gdb.execute(f"delete {bp_num}")
+                print_info(f"Breakpoint {bp_num} deleted.")
+
+        # Remove the prompt we showed after running fzf
+        event.app.output.cursor_up(T.cast(str, gdb.parameter("prompt")).count("\n") + 1)
+        event.app.renderer.erase()
+
+    run_in_terminal(_fzf_delete_breakpoint)
+
+
+def get_prefix_search(buffer: Buffer) -> HistoryPrefixSearch | None:
+    """
+    Return the prefix search of the history if the buffer is still showing one of its matches.
+    """
+    if not isinstance(buffer.history, GDBCommandsHistory):
+        return None
+    search = buffer.history.prefix_search
+    if search is None or search.index < 0 or buffer.text != search.text:
+        return None
+    return search
+
+
+@Condition
+def can_search_history_backward() -> bool:
+    buffer = get_app().current_buffer
+    if buffer.complete_state is not None or buffer.selection_state is not None:
+        return False
+    if buffer.document.cursor_position_row > 0 or not isinstance(
+        buffer.history, GDBCommandsHistory
+    ):
+        return False
+    return bool(buffer.document.text_before_cursor) or get_prefix_search(buffer) is not None
+
+
+@Condition
+def can_search_history_forward() -> bool:
+    buffer = get_app().current_buffer
+    if buffer.complete_state is not None or buffer.selection_state is not None:
+        return False
+    return buffer.document.on_last_line and get_prefix_search(buffer) is not None
+
+
+def step_prefix_search(buffer: Buffer, count: int, substring: bool = False) -> None:
+    """
+    Move `count` commands back in the commands which start with the text before the cursor, or
+    forward if `count` is negative, the original text is shown again after the newest match.
+
+    If `substring` is True, a new search looks for the commands which contain the text instead, or
+    match it if it's a `/regex/`.
+    """
+    history = T.cast(GDBCommandsHistory, buffer.history)
+    search = get_prefix_search(buffer)
+    if search is None or (substring and not search.substring):
+        # A substring search started while stepping through a prefix search keeps its original text
+        if search is None:
+            text, prefix = buffer.text, buffer.document.text_before_cursor
+        else:
+            text, prefix = search.original_text, search.prefix
+        if substring:
+            matches = iter_substring_matches(history, prefix)
+        else:
+            matches = history.iter_prefix_matches(prefix)
+        search = HistoryPrefixSearch(text, prefix, matches, substring)
+        history.prefix_search = search
+    for _ in range(abs(count)):
+        if count > 0 and search.match(search.index + 1) is not None:
+            search.index += 1
+        elif count < 0 and search.index >= 0:
+            search.index -= 1
+        else:
+            break
+    text = search.text
+    buffer.document = Document(text, len(search.prefix) if search.index < 0 else len(text))
+
+
+def iter_substring_matches(history: GDBCommandsHistory, query: str) -> T.Iterator[str]:
+    if len(query) >= 2 and query.startswith("/") and query.endswith("/"):
+        try:
+            re.compile(query[1:-1])
+            return history.search_commands(query[1:-1], regex=True)
+        except re.error:
+            # Search it as a substring then
+            pass
+    return history.search_commands(query)
+
+
+def history_substring_search(event: KeyPressEvent) -> None:
+    """Show the previous command which contains the text before the cursor, or matches a /regex/."""
+    step_prefix_search(event.current_buffer, event.arg, substring=True)
+
+
+def history_search_backward(event: KeyPressEvent) -> None:
+    """Show the previous command which starts with the text before the cursor."""
+    step_prefix_search(event.current_buffer, event.arg)
+
+
+def history_search_forward(event: KeyPressEvent) -> None:
+    """Show the next command which starts with the text before the cursor."""
+    step_prefix_search(event.current_buffer, -event.arg)
+
+
+class UserParameter(gdb.Parameter):
+    gep_loaded = False
+
+    def __init__(
+        self,
+        name: str,
+        default_value: T.Any,
+        set_show_doc: str,
+        parameter_class: int,
+        help_doc: str = "",
+        enum_sequence: T.Sequence | None = None,
+    ) -> None:
+        self.set_show_doc = set_show_doc
+        self.set_doc = f"Set {self.set_show_doc}."
+        self.show_doc = f"Show {self.set_show_doc}."
+        self.__doc__ = help_doc.strip() or None
+        if enum_sequence:
+            super().__init__(name, gdb.COMMAND_NONE, parameter_class, enum_sequence)
+        else:
+            super().__init__(name, gdb.COMMAND_NONE, parameter_class)
+        self.value = default_value
+
+    def get_set_string(self) -> str:
+        if not self.gep_loaded:
+            return ""
+        svalue = self.value
+        # TODO: Support other type when needed
+        if isinstance(svalue, bool):
+            svalue = "on" if svalue else "off"
+        return f"Set {self.set_show_doc} to {svalue!r}."
+
+    def get_show_string(self, svalue: T.Any) -> str:
+        if not self.gep_loaded:
+            return ""
+        return f"{self.set_show_doc.capitalize()} is {svalue!r}."
+
+
+single_column_tab_complete = UserParameter(
+    "single-column-tab-complete",
+    True,
+    "whether to use single column for tab completion",
+    gdb.PARAM_BOOLEAN,
+)
+
+UserParameter(
+    "fzf-run-opts",
+    "",
+    "additional options for fzf (used in tab completion or history search)",
+    gdb.PARAM_STRING_NOESCAPE,
+)
+
+UserParameter(
+    "fzf-preview-opts",
+    "",
+    "additional options for fzf preview window (used in tab completion)",
+    gdb.PARAM_STRING_NOESCAPE,
+)
+
+UserParameter(
+    "gep-cache-directory",
+    "",
+    "the directory for GEP's persistent caches (empty for $XDG_CACHE_HOME/gep)",
+    gdb.PARAM_STRING_NOESCAPE,
+)
+
+UserParameter(
+    "symbol-index",
+    True,
+    "whether to complete symbols of locations and expressions with GEP's symbol index",
+    gdb.PARAM_BOOLEAN,
+)
+
+UserParameter(
+    "symbol-cache-size",
+    256,
+    "the maximum size in MiB of the on-disk cache of symbol indexes (0 to disable the cache)",
+    gdb.PARAM_ZUINTEGER,
+)
+
+UserParameter(
+    "history-compact",
+    False,
+    "whether to keep the history in a compact buffer to save memory, building the history search "
+    "indexes scans the whole history then (takes effect at startup)",
+    gdb.PARAM_BOOLEAN,
+)
+
+UserParameter(
+    "history-per-binary",
+    False,
+    "whether to keep a history shard for each debugged executable, which is searched first",
+    gdb.PARAM_BOOLEAN,
+)
+
+UserParameter(
+    "history-frecency-limit",
+    0,
+    "the number of the top frecent commands used by Ctrl-R and autosuggestions (0 for unlimited)",
+    gdb.PARAM_ZUINTEGER,
+)
+
+UserParameter(
+    "completion-cache-size",
+    128,
+    "the maximum number of cached completion results (0 to disable the cache)",
+    gdb.PARAM_ZUINTEGER,
+)
+
+
+class GEPCommand(gdb.Command):
+    """Prefix command for GEP (GDB Enhanced Prompt) utilities."""
+
+    def __init__(self) -> None:
+        super().__init__("gep", gdb.COMMAND_SUPPORT, gdb.COMPLETE_NONE, True)
+
+    def invoke(self, argument: str, from_tty: bool) -> None:
+        gdb.execute("help gep", from_tty=from_tty)
+
+
+class CompletionCacheCommand(gdb.Command):
+    """Show the statistics of GEP's completion cache.
+    Usage: gep completion-cache [clear]
+    With `clear`, all cached completions are dropped.
+    """
+
+    def __init__(self, cache: CompletionCache) -> None:
+        super().__init__("gep completion-cache", gdb.COMMAND_SUPPORT, gdb.COMPLETE_NONE)
+        self._cache = cache
+
+    def invoke(self, argument: str, from_tty: bool) -> None:
+        argument = argument.strip()
+        if argument == "clear":
+            self._cache.invalidate()
+            print_info("Completion cache cleared.")
+            return
+        if argument:
+            raise gdb.GdbError(f"Invalid argument: {argument!r}")
+        served = self._cache.hits + self._cache.refinements
+        lookups = served + self._cache.misses
+        hit_rate = served / lookups * 100 if lookups else 0.0
+        print(f"Entries:    {len(self._cache)}/{self._cache.max_size}")
+        print(f"Hits:       {self._cache.hits}")
+        print(f"Refined:    {self._cache.refinements}")
+        print(f"Misses:     {self._cache.misses}")
+        print(f"Hit rate:   {hit_rate:.1f}%")
+        print(f"Generation: {self._cache.generation}")
+
+
+GEPCommand()
+CompletionCacheCommand(COMPLETION_CACHE)
+
+# key bindings for searching the history with the text before the cursor
+BINDINGS.add("up", filter=can_search_history_backward)(history_search_backward)
+BINDINGS.add("c-p", filter=can_search_history_backward)(history_search_backward)
+BINDINGS.add("down", filter=can_search_history_forward)(history_search_forward)
+BINDINGS.add("c-n", filter=can_search_history_forward)(history_search_forward)
+
+if HAS_FZF:
+    # key binding for fzf history search
+    BINDINGS.add("c-r")(fzf_reverse_search)
+    # the preview server is started by the first picker which needs it
+    atexit.register(FzfPreviewServer.close_shared)
+    # key binding for fzf tab completion
+    BINDINGS.add("c-i")(fzf_tab_autocomplete)
+    # key binding for fzf breakpoint toggle (Alt-t / Option-t)
+    # Also bind \u2020 (†) for macOS terminals where Option sends special characters
+    BINDINGS.add("escape", "t")(fzf_toggle_breakpoint)
+    BINDINGS.add("\u2020")(fzf_toggle_breakpoint)
+    # key binding for fzf breakpoint delete (Alt-x / Option-x)
+    # Also bind \u2248 (≈) for macOS terminals where Option sends special characters
+    BINDINGS.add("escape", "x")(fzf_delete_breakpoint)
+    BINDINGS.add("\u2248")(fzf_delete_breakpoint)
+else:
+    print_warning("Install fzf for better experience with GEP")
+    # key binding for history search by substring or regex, which replaces the linear search of
+    # prompt_toolkit
+    BINDINGS.add("c-r")(history_substring_search)
+
+
+# A newline which is followed by an empty line
+HISTORY_EMPTY_LINE_RE = re.compile(rb"\n(?=\n)")
+
+
+class HistoryFileLines(T.Sequence[str]):
+    """
+    The non-empty lines of a history file, oldest first.
+
+    The lines are indexed from the end of the file on demand, so the newest lines are available at once, and
+    the older ones are only decoded when they are accessed.
+    The file is read instead of memory-mapped, a writer which truncates it in place (e.g. an editor) would
+    crash GDB with SIGBUS when we touch the truncated pages.
+    """
+
+    def __init__(self, filename: str, keep_lines: bool = True) -> None:
+        with open(filename, "rb") as f:
+            self.inode = os.fstat(f.fileno()).st_ino
+            self._data = f.read()
+        self.size = self._end = len(self._data)
+        if self._data[self._end - 1 : self._end] == b"\n":
+            self._end -= 1
+        self._len = 0
+        if self._end > 0:
+            self._len = self._data.count(b"\n", 0, self._end) + 1
+            # Drop the empty lines, i.e. the first and the last lines if they are empty, and the ones between
+            # two newlines
+            self._len -= self._data[:1] == b"\n"
+            self._len -= len(HISTORY_EMPTY_LINE_RE.findall(self._data, 0, self._end))
+            self._len -= self._data[self._end - 1 : self._end] == b"\n"
+        # The start offsets of the lines which are indexed, newest first
+        self._starts = array("Q")
+        # prompt_toolkit reads the newest lines for every prompt, so keep the lines which are decoded unless we
+        # want to save the memory
+        self._lines: list[str | None] | None = [None] * self._len if keep_lines else None
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __iter__(self) -> T.Iterator[str]:
+        # Decoding the whole file at once is much faster than decoding the lines one by one
+        text = str(self._data[: self._end], "utf-8", "surrogateescape")
+        return filter(None, text.split("\n"))
+
+    @property
+    def nbytes(self) -> int:
+        """
+        The size of the file content, the index, and the decoded lines.
+        """
+        size = sys.getsizeof(self._data) + len(self._starts) * self._starts.itemsize
+        if self._lines is not None:
+            size += sys.getsizeof(self._lines)
+            size += sum(sys.getsizeof(line) for line in self._lines if line is not None)
+        return size
+
+    def _index_until(self, count: int) -> None:
+        # The end of the next line to index, i.e. its newline or the end of the file
+        pos = self._starts[-1] - 1 if self._starts else self._end
+        while len(self._starts) < count:
+            start = self._data.rfind(b"\n", 0, max(pos, 0)) + 1
+            if start < pos:
+                self._starts.append(start)
+            pos = start - 1
+
+    @T.overload
+    def __getitem__(self, idx: int) -> str: ...
+
+    @T.overload
+    def __getitem__(self, idx: slice) -> list[str]: ...
+
+    def __getitem__(self, idx: int | slice) -> str | list[str]:
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += self._len
+        if not 0 <= idx < self._len:
+            raise IndexError("history index out of range")
+        if self._lines is not None and self._lines[idx] is not None:
+            return T.cast(str, self._lines[idx])
+        # The index of the line from the end
+        k = self._len - 1 - idx
+        self._index_until(k + 1)
+        start = self._starts[k]
+        end = self._data.find(b"\n", start, self._end)
+        line = str(self._data[start : end if end >= 0 else self._end], "utf-8", "surrogateescape")
+        if self._lines is not None:
+            self._lines[idx] = line
+        return line
+
+
+class CompactHistorySlab:
+    """
+    The slab of a compact `HistoryStore`, the commands are kept in one UTF-8 buffer with an offset table
+    instead of one `str` per command, and they are decoded only when they are accessed.
+    """
+
+    def __init__(self, commands: T.Sequence[str] = ()) -> None:
+        encoded_commands = [command.encode("utf-8", "surrogateescape") for command in commands]
+        self._buffer = bytearray().join(encoded_commands)
+        # The command at `pos` is `_buffer[_offsets[pos] : _offsets[pos + 1]]`
+        self._offsets = array("I", itertools.accumulate(map(len, encoded_commands), initial=0))
+        # The lower 32 bits of the hashes are enough to find the candidates of a duplicate
+        self._hashes = array("I", [hash(command) & 0xFFFFFFFF for command in commands])
+        self._removed = bytearray(len(commands))
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    def append(self, command: str) -> None:
+        self._buffer += command.encode("utf-8", "surrogateescape")
+        self._offsets.append(len(self._buffer))
+        self._hashes.append(hash(command) & 0xFFFFFFFF)
+        self._removed.append(0)
+
+    def __getitem__(self, pos: int) -> str | None:
+        if self._removed[pos]:
+            return None
+        return self.command_at(pos)
+
+    def __setitem__(self, pos: int, value: None) -> None:
+        # A command can only be removed
+        self._removed[pos] = 1
+
+    def command_at(self, pos: int) -> str:
+        """
+        Return the command at `pos` even if it's removed.
+        """
+        return str(
+            self._buffer[self._offsets[pos] : self._offsets[pos + 1]], "utf-8", "surrogateescape"
+        )
+
+    def hash_at(self, pos: int) -> int:
+        return self._hashes[pos]
+
+    @property
+    def nbytes(self) -> int:
+        return (
+            len(self._buffer)
+            + len(self._offsets) * self._offsets.itemsize
+            + len(self._hashes) * self._hashes.itemsize
+            + len(self._removed)
+        )
+
+
+class CompactHistoryIndex:
+    """
+    The newest position of each command in a `CompactHistorySlab`.
+
+    It's an open addressing hash table in an array of positions, the hashes of the commands are read from the
+    slab, so it doesn't keep any Python object for a command.
+    """
+
+    EMPTY = 0xFFFFFFFF
+    DELETED = 0xFFFFFFFE
+
+    def __init__(self, slab: CompactHistorySlab, positions: T.Collection[int] = ()) -> None:
+        """
+        `positions` are the newest positions of the distinct commands in the slab.
+        """
+        self._slab = slab
+        self._fill(positions)
+
+    def __len__(self) -> int:
+        return self._len
+
+    def _lookup(self, command: str) -> tuple[int, bool]:
+        """
+        Return the slot of `command` and True, or the slot to insert it and False.
+        """
+        command_hash = hash(command) & 0xFFFFFFFF
+        mask = len(self._table) - 1
+        slot = command_hash & mask
+        free_slot = None
+        while True:
+            pos = self._table[slot]
+            if pos == self.EMPTY:
+                return (slot if free_slot is None else free_slot), False
+            if pos == self.DELETED:
+                if free_slot is None:
+                    free_slot = slot
+            elif self._slab.hash_at(pos) == command_hash and self._slab.command_at(pos) == command:
+                return slot, True
+            slot = (slot + 1) & mask
+
+    def get(self, command: str, default: int | None = None) -> int | None:
+        slot, found = self._lookup(command)
+        return self._table[slot] if found else default
+
+    def __setitem__(self, command: str, pos: int) -> None:
+        slot, found = self._lookup(command)
+        if not found:
+            self._len += 1
+            if self._table[slot] == self.EMPTY:
+                self._used += 1
+        self._table[slot] = pos
+        if self._used * 3 > len(self._table) * 2:
+            self._resize()
+
+    def __delitem__(self, command: str) -> None:
+        slot, found = self._lookup(command)
+        if not found:
+            raise KeyError(command)
+        self._table[slot] = self.DELETED
+        self._len -= 1
+
+    def _resize(self) -> None:
+        self._fill([pos for pos in self._table if pos < self.DELETED])
+
+    def _fill(self, positions: T.Collection[int]) -> None:
+        size = 8
+        while size < len(positions) * 2:
+            size *= 2
+        self._table = array("I", [self.EMPTY]) * size
+        mask = size - 1
+        # The commands are distinct, so we don't need to compare them
+        for pos in positions:
+            slot = self._slab.hash_at(pos) & mask
+            while self._table[slot] != self.EMPTY:
+                slot = (slot + 1) & mask
+            self._table[slot] = pos
+        # The number of the commands, and the number of the slots which are not empty
+        self._len = self._used = len(positions)
+
+    @property
+    def nbytes(self) -> int:
+        return len(self._table) * self._table.itemsize
+
+
+class HistoryStore:
+    """
+    The commands in the history, oldest first.
+
+    The commands are kept in an append-only slab, a removed command leaves a hole (None) in the slab, and the
+    slab is compacted once the trimmed and removed commands outnumber the live ones, so appending, removing
+    duplicates, and trimming are amortized O(1).
+    The newest position of each command is indexed, so a duplicate is found without scanning the history.
+
+    If the commands don't need to be deduplicated, a sequence of them (e.g. `HistoryFileLines`) is kept as an
+    archive before the slab, and it's only loaded into the slab when a duplicate might be in it.
+
+    If `compact` is True, the slab is a `CompactHistorySlab` to save the memory of huge histories. Its index
+    has no order, so `recent_distinct` scans the whole history, i.e. building the search indexes is slower.
+    """
+
+    def __init__(
+        self, commands: T.Iterable[str] = (), remove_duplicates: int = 0, compact: bool = False
+    ) -> None:
+        self.compact = compact
+        self._slab: list[str | None] | CompactHistorySlab = []
+        self._newest: dict[str, int] | CompactHistoryIndex = {}
+        self._new_slab([])
+        # The slab before `_head` is trimmed, and there are `_holes` removed commands after `_head`
+        self._head = 0
+        self._holes = 0
+        # The archive before `_archive_head` is trimmed
+        self._archive: T.Sequence[str] = ()
+        self._archive_head = 0
+        if remove_duplicates == 0 and isinstance(commands, T.Sequence):
+            self._archive = T.cast(T.Sequence[str], commands)
+            return
+        if compact:
+            # Replaying the commands in a list is much faster, convert it to the compact one at once
+            self._archive = list(HistoryStore(commands, remove_duplicates))
+            self._rebuild()
+            return
+        for command in commands:
+            self.append(command, remove_duplicates)
+
+    def _slab_len(self) -> int:
+        return len(self._slab) - self._head - self._holes
+
+    def __len__(self) -> int:
+        return len(self._archive) - self._archive_head + self._slab_len()
+
+    def _iter_slab(self) -> T.Iterator[str]:
+        for pos in range(self._head, len(self._slab)):
+            command = self._slab[pos]
+            if command is not None:
+                yield command
+
+    def _reversed_slab(self) -> T.Iterator[str]:
+        for pos in range(len(self._slab) - 1, self._head - 1, -1):
+            command = self._slab[pos]
+            if command is not None:
+                yield command
+
+    def __iter__(self) -> T.Iterator[str]:
+        archive_len = len(self._archive)
+        if self._archive_head > archive_len // 2:
+            # Most of the archive is trimmed, `HistoryFileLines` only decodes the newest lines this way
+            for idx in range(self._archive_head, archive_len):
+                yield self._archive[idx]
+        else:
+            yield from itertools.islice(self._archive, self._archive_head, None)
+        yield from self._iter_slab()
+
+    def __reversed__(self) -> T.Iterator[str]:
+        yield from self._reversed_slab()
+        for idx in range(len(self._archive) - 1, self._archive_head - 1, -1):
+            yield self._archive[idx]
+
+    def __getitem__(self, idx: int) -> str:
+        size = len(self)
+        if idx < 0:
+            idx += size
+        if not 0 <= idx < size:
+            raise IndexError("history index out of range")
+        archive_len = len(self._archive) - self._archive_head
+        if idx < archive_len:
+            return self._archive[self._archive_head + idx]
+        idx -= archive_len
+        if not self._holes:
+            return T.cast(str, self._slab[self._head + idx])
+        # Walk from the nearer end, the newest commands are the most wanted ones
+        slab_len = self._slab_len()
+        if idx < slab_len // 2:
+            return next(itertools.islice(self._iter_slab(), idx, None))
+        return next(itertools.islice(self._reversed_slab(), slab_len - 1 - idx, None))
+
+    def recent_distinct(self) -> T.Iterator[str]:
+        """
+        Iterate the distinct commands, the most recently used first.
+
+        This is O(distinct commands), but O(all commands) for a compact store or a store with an
+        archive, the archive is not loaded into the slab for this.
+        """
+        if isinstance(self._newest, CompactHistoryIndex) or len(self._archive) > self._archive_head:
+            # The compact index has no order, and the archive is not indexed, decode them at once
+            return iter(dict.fromkeys(reversed(list(self))))
+        return reversed(self._newest)
+
+    def _find_duplicate(self, command: str, window: int) -> int | None:
+        """
+        Return the position of the newest `command` if it's one of the newest `window` commands.
+        """
+        pos = self._newest.get(command)
+        if pos is None or window < 0 or len(self._slab) - pos <= window:
+            return pos
+        # The holes after `pos` might bring it into the window
+        newer = 0
+        for newer_pos in range(len(self._slab) - 1, pos, -1):
+            if self._slab[newer_pos] is not None:
+                newer += 1
+                if newer >= window:
+                    return None
+        return pos
+
+    def append(self, command: str, remove_duplicates: int = 0) -> None:
+        """
+        Append `command`, and remove its newest duplicate if it's one of the newest `remove_duplicates` commands.
+        A negative `remove_duplicates` means unlimited.
+        """
+        if remove_duplicates != 0:
+            if len(self._archive) > self._archive_head:
+                self._rebuild()
+            pos = self._find_duplicate(command, remove_duplicates)
+            if pos is not None:
+                self._slab[pos] = None
+                self._holes += 1
+        self._slab.append(command)
+        newest = self._newest
+        if not isinstance(newest, CompactHistoryIndex):
+            # Keep the index in the most recently used order
+            newest.pop(command, None)
+        newest[command] = len(self._slab) - 1
+        self._compact_if_sparse()
+
+    def trim(self, max_size: int, on_remove: T.Callable[[str], None] | None = None) -> int:
+        """
+        Remove the oldest commands until there are at most `max_size` commands, return the number of removed ones.
+        `on_remove` is called with each distinct command which is no longer in the history.
+        """
+        removed = min(max(len(self) - max_size, 0), len(self._archive) - self._archive_head)
+        self._archive_head += removed
+        while len(self) > max_size:
+            command = self._slab[self._head]
+            self._slab[self._head] = None
+            self._head += 1
+            if command is None:
+                self._holes -= 1
+                continue
+            # The older duplicates are trimmed already if the newest one is trimmed
+            if self._newest.get(command) == self._head - 1:
+                del self._newest[command]
+                if on_remove is not None:
+                    on_remove(command)
+            removed += 1
+        self._compact_if_sparse()
+        return removed
+
+    def _compact_if_sparse(self) -> None:
+        if self._head + self._holes > self._slab_len():
+            self._rebuild()
+
+    def _rebuild(self) -> None:
+        """
+        Load the archive and drop the holes of the slab.
+        """
+        self._new_slab(list(self))
+        self._head = 0
+        self._holes = 0
+        self._archive = ()
+        self._archive_head = 0
+
+    def _new_slab(self, commands: list[str]) -> None:
+        newest = {command: pos for pos, command in enumerate(commands)}
+        if len(newest) < len(commands):
+            # Keep the index in the most recently used order
+            newest = dict(sorted(newest.items(), key=lambda item: item[1]))
+        if self.compact:
+            self._slab = CompactHistorySlab(commands)
+            self._newest = CompactHistoryIndex(self._slab, newest.values())
+        else:
+            self._slab = T.cast("list[str | None]", commands)
+            self._newest = newest
+
+    def string_ids(self) -> set[int]:
+        """
+        Return the ids of the strings of the commands which are kept in the slab, a compact slab keeps
+        none.
+        """
+        if isinstance(self._slab, CompactHistorySlab):
+            return set()
+        return {id(command) for command in self._slab if command is not None}
+
+    @property
+    def nbytes(self) -> int:
+        """
+        The approximate size of the commands in memory, including the content of the history file.
+        """
+        if isinstance(self._slab, CompactHistorySlab) and isinstance(
+            self._newest, CompactHistoryIndex
+        ):
+            size = self._slab.nbytes + self._newest.nbytes
+        else:
+            # The commands are shared by the slab and the index
+            size = sys.getsizeof(self._slab) + sys.getsizeof(self._newest)
+            size += sum(sys.getsizeof(command) for command in self._slab if command is not None)
+        if isinstance(self._archive, HistoryFileLines):
+            size += self._archive.nbytes
+        return size
+
+
+class HistoryView(T.Sequence[str]):
+    """
+    A read-only view of the commands in a `HistoryStore`, oldest first, or newest first if `reverse` is True.
+    """
+
+    def __init__(self, store: HistoryStore, reverse: bool = False) -> None:
+        self._store = store
+        self._reverse = reverse
+
+    def __len__(self) -> int:
+        return len(self._store)
+
+    @T.overload
+    def __getitem__(self, idx: int) -> str: ...
+
+    @T.overload
+    def __getitem__(self, idx: slice) -> list[str]: ...
+
+    def __getitem__(self, idx: int | slice) -> str | list[str]:
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        if self._reverse:
+            return self._store[-1 - idx if idx >= 0 else -1 - (idx + len(self))]
+        return self._store[idx]
+
+    def __iter__(self) -> T.Iterator[str]:
+        return reversed(self._store) if self._reverse else iter(self._store)
+
+    def __reversed__(self) -> T.Iterator[str]:
+        return iter(self._store) if self._reverse else reversed(self._store)
+
+
+# Rebuild the text index, or the ranking of a prefix index, once at least this many distinct commands are
+# used after it's built
+HISTORY_PREFIX_INDEX_RECENT_SIZE = 1024
+# The sorted commands of a prefix index are kept in blocks of at most this many commands
+HISTORY_PREFIX_INDEX_BLOCK_SIZE = 512
+
+
+class HistoryPrefixIndex:
+    """
+    Find the best commands starting with a prefix without scanning the whole history.
+
+    The distinct commands are kept sorted in blocks, and each block knows its best priority, so the
+    commands starting with a prefix are a range of blocks found with bisect, and only the blocks
+    which might have the best ones are looked into. A command is added, updated, or removed in its
+    own block, so the index follows the history as the commands are stored and trimmed, and it's
+    never rebuilt.
+    The blocks of the existing commands are built in a background thread, the commands are scanned
+    until they are ready, and the changes made meanwhile are applied to them.
+    """
+
+    def __init__(
+        self, commands: T.Iterable[str], priority: T.Callable[[str, int], float] | None = None
+    ) -> None:
+        """
+        :param commands: The distinct commands, the most recently used first.
+        :param priority: Return the priority of a command and its position in `commands`, the higher
+            the better. If it's None, the newer commands are better.
+        """
+        self._priority = priority
+        # The commands in `__init__` while the blocks are being built, None once they are built
+        self._snapshot: list[str] | None = list(filter(None, commands))
+        # The priorities of the commands changed while building, None if a command is removed
+        self._changes: dict[str, float | None] = {}
+        self._built: tuple[list[str], list[list[str]], list[array[float]], array[float]] | None
+        self._built = None
+        # The first command, the commands, their priorities, and the best priority of each block
+        self._keys: list[str] = []
+        self._blocks: list[list[str]] = []
+        self._priorities: list[array[float]] = []
+        self._bests = array("d")
+        # The commands used later are newer than all of the existing ones
+        self._next_recency = 1
+        # The negated priorities and the commands, the best first, and the commands changed after it's
+        # ranked, the priorities are kept in an array to save the memory of a tuple per command
+        self._ranked: tuple[array[float], list[str]] | None = None
+        self._ranked_changes: dict[str, float | None] = {}
+        self._builder = threading.Thread(target=self._build, args=(self._snapshot,), daemon=True)
+        self._builder.start()
+
+    def __len__(self) -> int:
+        self._sync()
+        if self._snapshot is not None:
+            return len(self._snapshot) + len(self._changes)
+        return sum(map(len, self._blocks))
+
+    @property
+    def nbytes(self) -> int:
+        """
+        The size of the blocks and the ranking, the commands are not counted, see `iter_commands`.
+        """
+        self._sync()
+        if self._snapshot is not None:
+            return sys.getsizeof(self._snapshot) + sys.getsizeof(self._changes)
+        size = sum(map(sys.getsizeof, (self._keys, self._blocks, self._priorities, self._bests)))
+        size += sum(map(sys.getsizeof, self._blocks)) + sum(map(sys.getsizeof, self._priorities))
+        if self._ranked is not None:
+            keys, commands = self._ranked
+            size += keys.itemsize * len(keys) + sys.getsizeof(commands)
+        return size
+
+    def iter_commands(self) -> T.Iterator[str]:
+        """
+        Iterate the commands in the index, they might be shared with the history and the other indexes.
+        """
+        self._sync()
+        if self._snapshot is not None:
+            yield from self._snapshot
+            yield from self._changes
+        else:
+            for block in self._blocks:
+                yield from block
+
+    def _initial_priority(self, command: str, position: int) -> float:
+        return -position if self._priority is None else self._priority(command, position)
+
+    def _build(self, commands: list[str]) -> None:
+        items = sorted(
+            (command, self._initial_priority(command, pos)) for pos, command in enumerate(commands)
+        )
+        # Leave room in the blocks, so the first insertions don't split them
+        size = HISTORY_PREFIX_INDEX_BLOCK_SIZE // 2
+        blocks = [
+            [command for command, _ in items[i : i + size]] for i in range(0, len(items), size)
+        ]
+        priorities = [
+            array("d", [priority for _, priority in items[i : i + size]])
+            for i in range(0, len(items), size)
+        ]
+        bests = array("d", map(max, priorities))
+        self._built = ([block[0] for block in blocks], blocks, priorities, bests)
+
+    def _sync(self) -> None:
+        """
+        Take the blocks once they are built, and apply the changes made meanwhile.
+        """
+        if self._snapshot is None or self._built is None:
+            return
+        self._keys, self._blocks, self._priorities, self._bests = self._built
+        self._snapshot = self._built = None
+        for command, priority in self._changes.items():
+            if priority is None:
+                self._remove(command)
+            else:
+                self._set(command, priority)
+        self._changes.clear()
+
+    def add(self, command: str) -> None:
+        if not command:
+            return
+        if self._priority is None:
+            priority = self._next_recency
+            self._next_recency += 1
+        else:
+            priority = self._priority(command, 0)
+        self._change(command, priority)
+
+    def remove(self, command: str) -> None:
+        """
+        Remove `command`, e.g. it's trimmed from the history.
+        """
+        self._change(command, None)
+
+    def _change(self, command: str, priority: float | None) -> None:
+        self._sync()
+        if self._snapshot is not None:
+            self._changes[command] = priority
+            return
+        if priority is None:
+            self._remove(command)
+        else:
+            self._set(command, priority)
+        self._ranked_changes[command] = priority
+
+    def _locate(self, command: str) -> tuple[int, int, bool]:
+        """
+        Return the block where `command` is or should be, its position in it, and whether it's there.
+        """
+        idx = max(bisect.bisect_right(self._keys, command) - 1, 0)
+        block = self._blocks[idx]
+        pos = bisect.bisect_left(block, command)
+        return idx, pos, pos < len(block) and block[pos] == command
+
+    def _set(self, command: str, priority: float) -> None:
+        if not self._blocks:
+            self._keys.append(command)
+            self._blocks.append([command])
+            self._priorities.append(array("d", [priority]))
+            self._bests.append(priority)
+            return
+        idx, pos, found = self._locate(command)
+        block, priorities = self._blocks[idx], self._priorities[idx]
+        if found:
+            old_priority = priorities[pos]
+            priorities[pos] = priority
+            if priority >= self._bests[idx]:
+                self._bests[idx] = priority
+            elif old_priority == self._bests[idx]:
+                self._bests[idx] = max(priorities)
+            return
+        block.insert(pos, command)
+        priorities.insert(pos, priority)
+        self._keys[idx] = block[0]
+        self._bests[idx] = max(self._bests[idx], priority)
+        if len(block) > HISTORY_PREFIX_INDEX_BLOCK_SIZE:
+            half = len(block) // 2
+            self._blocks[idx : idx + 1] = [block[:half], block[half:]]
+            self._priorities[idx : idx + 1] = [priorities[:half], priorities[half:]]
+            self._keys.insert(idx + 1, block[half])
+            self._bests[idx : idx + 1] = array(
+                "d", [max(priorities[:half]), max(priorities[half:])]
+            )
+
+    def _remove(self, command: str) -> None:
+        if not self._blocks:
+            return
+        idx, pos, found = self._locate(command)
+        if not found:
+            return
+        block, priorities = self._blocks[idx], self._priorities[idx]
+        priority = priorities[pos]
+        del block[pos]
+        del priorities[pos]
+        if not block:
+            del self._keys[idx], self._blocks[idx], self._priorities[idx], self._bests[idx]
+            return
+        self._keys[idx] = block[0]
+        if priority == self._bests[idx]:
+            self._bests[idx] = max(priorities)
+
+    def iter_matches(self, prefix: str) -> T.Iterator[str]:
+        """
+        Iterate the distinct commands which start with `prefix`, the best first.
+        """
+        self._sync()
+        if self._snapshot is not None:
+            matches = self._scan(prefix)
+        else:
+            matches = self._iter_blocks(prefix)
+        for _, command in matches:
+            yield command
+
+    def best(self, prefix: str) -> str | None:
+        return next(self.iter_matches(prefix), None)
+
+    def ranked(self) -> list[str]:
+        """
+        Return all commands, the best first.
+        """
+        if self._snapshot is not None:
+            # Ranking the snapshot is as slow as building the blocks
+            self._builder.join()
+        self._sync()
+        if self._ranked is None or len(self._ranked_changes) > max(
+            HISTORY_PREFIX_INDEX_RECENT_SIZE, len(self._ranked[1]) // 64
+        ):
+            items = sorted(
+                (-priority, command)
+                for block, priorities in zip(self._blocks, self._priorities)
+                for command, priority in zip(block, priorities)
+            )
+            self._ranked = (
+                array("d", [key for key, _ in items]),
+                [command for _, command in items],
+            )
+            self._ranked_changes.clear()
+        keys, commands = self._ranked
+        changes = self._ranked_changes
+        # The priorities of the changed commands in the ranking are outdated
+        # Put the changed commands into the ranking by their new priorities
+        changed = sorted(
+            (-priority, command) for command, priority in changes.items() if priority is not None
+        )
+        ranked: list[str] = []
+        start = 0
+        for key, changed_command in changed:
+            # The commands with the same priority are sorted
+            lo = bisect.bisect_left(keys, key, start)
+            hi = bisect.bisect_right(keys, key, lo)
+            end = bisect.bisect_left(commands, changed_command, lo, hi)
+            ranked += [command for command in commands[start:end] if command not in changes]
+            ranked.append(changed_command)
+            start = end
+        ranked += [command for command in commands[start:] if command not in changes]
+        return ranked
+
+    def _scan(self, prefix: str) -> T.Iterator[tuple[float, str]]:
+        """
+        Iterate the commands which start with `prefix` and their negated priorities, the best first,
+        without the blocks.
+        """
+        snapshot = T.cast(list[str], self._snapshot)
+        changes = self._changes
+        changed = sorted(
+            (-priority, command)
+            for command, priority in changes.items()
+            if priority is not None and command.startswith(prefix)
+        )
+        matches: T.Iterator[tuple[float, str]] = (
+            (-self._initial_priority(command, pos), command)
+            for pos, command in enumerate(snapshot)
+            if command.startswith(prefix) and command not in changes
+        )
+        if self._priority is not None:
+            # Only the newer commands are better in the order of the snapshot
+            matches = iter(sorted(matches))
+        return heapq.merge(changed, matches)
+
+    def _iter_blocks(self, prefix: str) -> T.Iterator[tuple[float, str]]:
+        """
+        Iterate the commands which start with `prefix` and their negated priorities, the best first.
+        """
+        end_key = prefix + "\U0010ffff"
+        # The best priority and the range of each block which has some matches
+        ranges: list[tuple[float, int, int, int]] = []
+        for idx in range(max(bisect.bisect_right(self._keys, prefix) - 1, 0), len(self._blocks)):
+            if self._keys[idx] >= end_key:
+                break
+            block, priorities = self._blocks[idx], self._priorities[idx]
+            lo = bisect.bisect_left(block, prefix) if block[0] < prefix else 0
+            hi = bisect.bisect_left(block, end_key, lo) if block[-1] >= end_key else len(block)
+            if lo >= hi:
+                continue
+            if hi - lo == len(block):
+                best = self._bests[idx]
+            else:
+                best = max(priorities[lo:hi])
+            ranges.append((-best, idx, lo, hi))
+        heapq.heapify(ranges)
+        # Open a block only when it might have a better command than the ones which are opened
+        matches: list[tuple[float, str]] = []
+        while ranges or matches:
+            if ranges and (not matches or ranges[0][0] <= matches[0][0]):
+                _, idx, lo, hi = heapq.heappop(ranges)
+                block, priorities = self._blocks[idx], self._priorities[idx]
+                for pos in range(lo, hi):
+                    heapq.heappush(matches, (-priorities[pos], block[pos]))
+            else:
+                yield heapq.heappop(matches)
+
+
+# The number of the hex digits after the escapes of characters by their codes in a regex
+REGEX_ESCAPE_PAYLOAD_SIZES = {"x": 2, "u": 4, "U": 8}
+
+
+def get_required_literal(pattern: str) -> str:
+    """
+    Return the longest literal which every match of the regex `pattern` contains, or "" if we can't
+    tell, e.g. the pattern has alternatives or inline flags.
+    """
+    if "|" in pattern or "(?" in pattern:
+        return ""
+    runs = [""]
+    depth = 0
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        i += 1
+        if char == "\\" and i < len(pattern):
+            start = i
+            char = pattern[i]
+            i += 1
+            if char.isalnum():
+                # A character class, an anchor, a backreference, or an escape of a character by its
+                # code or name, e.g. \d, \b, \1, \x41, \101, \N{DASH}, skip the digits or the name
+                # after it
+                if char in REGEX_ESCAPE_PAYLOAD_SIZES:
+                    i += REGEX_ESCAPE_PAYLOAD_SIZES[char]
+                elif char == "N":
+                    i = pattern.find("}", i) + 1 or len(pattern)
+                elif char.isdigit():
+                    while i < len(pattern) and pattern[i].isdigit() and i - start < 3:
+                        i += 1
+                runs.append("")
+                continue
+        elif char == "[":
+            # Skip the character set, `]` right after `[` or `[^` is a literal
+            if pattern.startswith("^", i):
+                i += 1
+            if pattern.startswith("]", i):
+                i += 1
+            while i < len(pattern) and pattern[i] != "]":
+                i += 2 if pattern[i] == "\\" else 1
+            i += 1
+            runs.append("")
+            continue
+        elif char in "*?{":
+            # The previous character is optional
+            runs[-1] = runs[-1][:-1]
+            runs.append("")
+            if char == "{":
+                i = pattern.find("}", i) + 1 or len(pattern)
+            continue
+        elif char in "+.^$()":
+            depth += {"(": 1, ")": -1}.get(char, 0)
+            runs.append("")
+            continue
+        if depth == 0:
+            runs[-1] += char
+        else:
+            # The group might be optional
+            runs.append("")
+    return max(runs, key=lambda run: len(run))
+
+
+class HistoryTextIndex:
+    """
+    Find the commands which contain a substring or match a regex without checking them one by one.
+
+    The distinct commands are joined into one text, the most recently used first, so a search is a
+    few `str.find` calls, which run in C, and the matches come out newest first. A regex is only
+    checked against the commands which contain its longest required literal. The commands are
+    sliced out of the text when they match, the index doesn't keep a string per command.
+    The commands used after the index is built are kept in a small most-recently-used dict, which
+    is searched first.
+    """
+
+    def __init__(self, commands: T.Iterable[str]) -> None:
+        """
+        :param commands: The distinct commands, the most recently used first.
+        """
+        commands = list(filter(None, commands))
+        self._len = len(commands)
+        # The commands never contain NUL, so a match never spans two commands
+        self._text = "\0".join(commands)
+        lengths = itertools.accumulate(map(len, commands), initial=0)
+        # The start of each command, and the end of the text plus one
+        self._starts = array("Q", map(int.__add__, lengths, itertools.count()))
+        self._recent: dict[str, None] = {}
+        self._removed: set[str] = set()
+
+    def __len__(self) -> int:
+        return self._len + len(self._recent)
+
+    @property
+    def nbytes(self) -> int:
+        return (
+            sys.getsizeof(self._text)
+            + self._starts.itemsize * len(self._starts)
+            + sys.getsizeof(self._recent)
+            + sys.getsizeof(self._removed)
+        )
+
+    def iter_commands(self) -> T.Iterator[str]:
+        """
+        Iterate the strings which the index keeps, i.e. the commands changed after it's built.
+        """
+        yield from self._recent
+        yield from self._removed
+
+    @property
+    def is_full(self) -> bool:
+        changes = len(self._recent) + len(self._removed)
+        return changes > max(HISTORY_PREFIX_INDEX_RECENT_SIZE, self._len // 64)
+
+    def add(self, command: str) -> None:
+        if command:
+            self._recent.pop(command, None)
+            self._recent[command] = None
+            self._removed.discard(command)
+
+    def remove(self, command: str) -> None:
+        self._recent.pop(command, None)
+        self._removed.add(command)
+
+    def search(self, query: str, regex: bool = False) -> T.Iterator[str]:
+        """
+        Iterate the distinct commands which contain `query`, or match it if `regex` is True, the
+        most recently used first. `re.error` is raised if the regex is invalid.
+        """
+        is_match = get_history_matcher(query, regex)
+        literal = get_required_literal(query) if regex else query
+        for command in list(reversed(self._recent)):
+            if is_match(command):
+                yield command
+        # The removed commands and the outdated positions of the recent ones are skipped
+        skipped = self._removed.union(self._recent)
+        if not literal:
+            for command in self._text.split("\0") if self._len else ():
+                if command not in skipped and is_match(command):
+                    yield command
+            return
+        pos = self._text.find(literal)
+        while pos >= 0:
+            idx = bisect.bisect_right(self._starts, pos) - 1
+            command = self._text[self._starts[idx] : self._starts[idx + 1] - 1]
+            if command not in skipped and (not regex or is_match(command)):
+                yield command
+            pos = self._text.find(literal, self._starts[idx + 1])
+
+
+def get_history_matcher(query: str, regex: bool = False) -> T.Callable[[str], bool]:
+    """
+    Return a function which checks whether a command contains `query`, or matches it if `regex` is
+    True. `re.error` is raised if the regex is invalid.
+    """
+    if regex:
+        search = re.compile(query).search
+        return lambda command: search(command) is not None
+    return lambda command: query in command
+
+
+class HistoryPrefixSearch:
+    """
+    The state of stepping through the commands which start with the text before the cursor with
+    up and down, or contain it if `substring` is True.
+    """
+
+    def __init__(
+        self, text: str, prefix: str, matches: T.Iterator[str], substring: bool = False
+    ) -> None:
+        self.original_text = text
+        self.prefix = prefix
+        self.substring = substring
+        self.index = -1
+        self._matches: list[str] = []
+        self._pending = matches
+
+    def match(self, index: int) -> str | None:
+        while len(self._matches) <= index:
+            command = next(self._pending, None)
+            if command is None:
+                return None
+            if command != self.original_text:
+                self._matches.append(command)
+        return self._matches[index]
+
+    @property
+    def text(self) -> str:
+        return self.original_text if self.index < 0 else self._matches[self.index]
+
+
+# The weight of a use of a command halves every this many seconds
+HISTORY_FRECENCY_HALF_LIFE = 7 * 24 * 60 * 60
+# The counters of the commands which are not used for this many half-lives are not saved
+HISTORY_FRECENCY_MAX_AGE = 52
+
+
+def log2_add(a: float, b: float) -> float:
+    """
+    Return log2(2 ** a + 2 ** b) without overflowing.
+    """
+    if a < b:
+        a, b = b, a
+    return a + math.log2(1 + 2 ** (b - a))
+
+
+class HistoryFrecency:
+    """
+    Count how often and how recently each distinct command is used.
+
+    The weight of a use halves every `HISTORY_FRECENCY_HALF_LIFE` seconds, so the order of the
+    scores doesn't change over time, and a score is only updated when its command is used.
+    A score is the log2 of the sum of 2 ** (time of use / half-life), so it doesn't overflow.
+
+    The counters are saved to `<history filename>.frecency`, each session adds its own uses to the
+    file at exit.
+    """
+
+    def __init__(self, base_time: float) -> None:
+        """
+        :param base_time: The time which the commands without counters are assumed to be used at.
+        """
+        self.base_time = base_time
+        self._slots: dict[str, int] = {}
+        self._counts = array("I")
+        self._scores = array("d")
+        # The uses of this session, they are added to the file when saving
+        self._own: dict[str, tuple[int, float]] = {}
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def __iter__(self) -> T.Iterator[str]:
+        return iter(self._slots)
+
+    @property
+    def nbytes(self) -> int:
+        return (
+            sys.getsizeof(self._slots)
+            + self._counts.itemsize * len(self)
+            + self._scores.itemsize * len(self)
+        )
+
+    def count(self, command: str) -> int:
+        slot = self._slots.get(command)
+        return 0 if slot is None else self._counts[slot]
+
+    def priority(self, command: str, position: int) -> float:
+        """
+        Return the score of a command, or if it has no counters, the score of a single use at the
+        base time. `position` is the position of the command in the distinct commands, the most
+        recently used first, so the commands without counters are ranked by recency.
+        """
+        slot = self._slots.get(command)
+        if slot is not None:
+            return self._scores[slot]
+        return (self.base_time - position) / HISTORY_FRECENCY_HALF_LIFE
 
-    def _fzf_delete_breakpoint() -> None:
-        breakpoints = gdb.breakpoints() or []
-        if not breakpoints:
-            print_warning("No breakpoints set.")
+    def record(self, command: str, own: bool = True, now: float | None = None) -> None:
+        """
+        Record a use of `command`, `own` is False if it's used by another session, which saves it
+        by itself.
+        """
+        if not command or "\n" in command:
+            # The history file has a line per command
             return
+        score = (time.time() if now is None else now) / HISTORY_FRECENCY_HALF_LIFE
+        self._add(command, 1, score)
+        if own:
+            count, own_score = self._own.get(command, (0, -math.inf))
+            self._own[command] = (count + 1, log2_add(own_score, score))
+
+    def _add(self, command: str, count: int, score: float) -> None:
+        slot = self._slots.get(command)
+        if slot is None:
+            self._slots[command] = len(self._counts)
+            self._counts.append(min(count, 0xFFFFFFFF))
+            self._scores.append(score)
+            return
+        self._counts[slot] = min(self._counts[slot] + count, 0xFFFFFFFF)
+        self._scores[slot] = log2_add(self._scores[slot], score)
 
-        # Show prompt while running fzf
-        event.app.renderer.render(event.app, event.app.layout, is_done=True)
+    @staticmethod
+    def read_file(f: T.BinaryIO) -> T.Iterator[tuple[str, int, float]]:
+        for line in f:
+            try:
+                count, score, command = line.rstrip(b"\n").split(b" ", 2)
+                yield command.decode("utf-8", "surrogateescape"), int(count), float(score)
+            except ValueError:
+                # Ignore the broken lines, e.g. the file is written by hand
+                continue
 
-        # Create FIFOs for preview
-        fifo_input, fifo_output = create_preview_fifos()
-        preview_cmd = f"echo {{}} > {fifo_input}\ncat {fifo_output}"
+    def load(self, filename: str) -> None:
+        try:
+            with open(filename, "rb") as f:
+                fcntl.flock(f, fcntl.LOCK_SH)
+                for command, count, score in self.read_file(f):
+                    self._add(command, count, score)
+        except FileNotFoundError:
+            pass
 
-        # Use --nth to restrict search to NUM and LOCATION fields (skip circle)
-        p = create_fzf_process(
-            "",
-            preview_cmd,
-            use_select_1=False,
-            extra_opts=("--ansi", "--nth=2.."),
-        )
+    def save(self, filename: str) -> None:
+        """
+        Add the uses of this session to the file, the uses saved by the other sessions meanwhile are
+        kept.
+        """
+        if not self._own:
+            return
+        with open(filename, "a+b") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            counters: dict[str, tuple[int, float]] = {}
+            for command, count, score in self.read_file(f):
+                counters[command] = (count, score)
+            for command, (count, score) in self._own.items():
+                saved_count, saved_score = counters.get(command, (0, -math.inf))
+                counters[command] = (saved_count + count, log2_add(saved_score, score))
+            min_score = time.time() / HISTORY_FRECENCY_HALF_LIFE - HISTORY_FRECENCY_MAX_AGE
+            f.truncate(0)
+            f.writelines(
+                f"{count} {score!r} ".encode() + command.encode("utf-8", "surrogateescape") + b"\n"
+                for command, (count, score) in counters.items()
+                if score >= min_score
+            )
+        self._own.clear()
 
-        for bp in breakpoints:
-            if bp.number < 0:
-                continue
-            line = format_breakpoint_for_fzf(bp)
-            p.stdin.write(line + "\n")  # ty: ignore[unresolved-attribute]
 
-        t = FzfBreakpointPreviewThread(fifo_input, fifo_output)
-        t.start()
-        stdout, _ = p.communicate()
-        t.stop()
+# fsync the history file at most once per this many seconds
+HISTORY_FSYNC_INTERVAL = 1.0
+# prompt_toolkit loads this many commands of the history at a time
+HISTORY_LOAD_CHUNK_SIZE = 1024
+# Compact the history file once it has more lines than this and twice the history size
+HISTORY_COMPACT_MIN_LINES = 1024
 
-        if stdout:
-            bp_num = parse_bp_number_from_fzf_output(stdout.strip())
-            if bp_num is not None:
-                gdb.execute(f"delete {bp_num}")
-                print_info(f"Breakpoint {bp_num} deleted.")
 
-        # Remove the prompt we showed after running fzf
-        event.app.output.cursor_up(T.cast(str, gdb.parameter("prompt")).count("\n") + 1)
-        event.app.renderer.erase()
+class HistoryJournal:
+    """
+    Append the commands to the history file as they are entered, so a crash of GDB doesn't lose them, and
+    tail the commands which are appended by the other GDB sessions.
 
-    run_in_terminal(_fzf_delete_breakpoint)
+    The file is still a plain GDB history file with one command per line, and it's only written under an
+    `fcntl` lock. Each command is flushed at once, but fsync'ed at most once per `HISTORY_FSYNC_INTERVAL`
+    seconds. Duplicates and trimmed commands pile up in the file, so it's compacted in the background and
+    replaced with an atomic rename, the other sessions reopen it when they find it replaced.
+    """
 
+    def __init__(self, filename: str, lines: int | None, offset: int, inode: int | None) -> None:
+        self.filename = filename
+        # The number of lines in the file, None if they are not counted, the compactor counts them
+        self.lines = lines
+        # The size of the file which we have read or written, and the inode of the file
+        self._offset = offset
+        self._inode = inode
+        self._file: T.BinaryIO | None = None
+        self._last_fsync = 0.0
+        # Guard the file against the compactor, `fcntl.flock` doesn't work between threads
+        self._lock = threading.Lock()
+        self._compactor: threading.Thread | None = None
+        # The error of the last compaction, the compactor can't print it while the prompt owns the terminal
+        self._compact_error: OSError | None = None
+
+    def _lock_file(self, operation: int) -> T.BinaryIO:
+        """
+        Open the file if it's not opened, and lock it with `operation`. `self._lock` must be held.
+        """
+        while True:
+            if self._file is None:
+                dirpath = os.path.dirname(self.filename)
+                if dirpath:
+                    os.makedirs(dirpath, exist_ok=True)
+                self._file = open(self.filename, "a+b")
+            f = self._file
+            fcntl.flock(f, operation)
+            inode = os.fstat(f.fileno()).st_ino
+            try:
+                replaced = os.stat(self.filename).st_ino != inode
+            except FileNotFoundError:
+                replaced = True
+            if replaced:
+                # The file is replaced while we are waiting for the lock, the lock is released by closing it
+                f.close()
+                self._file = None
+                continue
+            if self._inode is not None and self._inode != inode:
+                # The file is compacted by another session, we can't tell which lines are new in it, so just
+                # tail it from the end
+                f.seek(0)
+                self.lines = sum(chunk.count(b"\n") for chunk in iter(lambda: f.read(1 << 20), b""))
+                self._offset = f.tell()
+            self._inode = inode
+            return f
+
+    def _read_new_commands(self, f: T.BinaryIO) -> list[str]:
+        f.seek(self._offset)
+        data = f.read()
+        # Ignore the last line if it's not finished
+        data = data[: data.rfind(b"\n") + 1]
+        self._offset += len(data)
+        commands = data.decode("utf-8", "surrogateescape").splitlines()
+        if self.lines is not None:
+            self.lines += len(commands)
+        return [command for command in commands if command]
+
+    def read_new_commands(self) -> list[str]:
+        """
+        Return the commands which are appended by the other sessions since the last read.
+        """
+        # This is called before each prompt, so check the file without locking it first
+        try:
+            st = os.stat(self.filename)
+        except FileNotFoundError:
+            return []
+        if st.st_ino == self._inode and st.st_size == self._offset:
+            return []
+        with self._lock:
+            f = self._lock_file(fcntl.LOCK_SH)
+            try:
+                return self._read_new_commands(f)
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
 
-class UserParameter(gdb.Parameter):
-    gep_loaded = False
+    def append(self, command: str) -> list[str]:
+        """
+        Append `command`, and return the commands which are appended by the other sessions since the last read.
+        """
+        with self._lock:
+            f = self._lock_file(fcntl.LOCK_EX)
+            try:
+                new_commands = self._read_new_commands(f)
+                line = command.encode("utf-8", "surrogateescape") + b"\n"
+                f.seek(0, os.SEEK_END)
+                if f.tell() > 0:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        # The last line is not terminated, e.g. the file is written by hand
+                        line = b"\n" + line
+                f.write(line)
+                f.flush()
+                self._offset = f.tell()
+                if self.lines is not None:
+                    self.lines += command.count("\n") + 1
+                if time.monotonic() - self._last_fsync >= HISTORY_FSYNC_INTERVAL:
+                    os.fsync(f.fileno())
+                    self._last_fsync = time.monotonic()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        return new_commands
+
+    def close(self) -> None:
+        if self._compactor is not None:
+            self._compactor.join()
+        with self._lock:
+            if self._file is not None:
+                os.fsync(self._file.fileno())
+                self._file.close()
+                self._file = None
+
+    def should_compact(self, size: int) -> bool:
+        """
+        Return whether the file has much more lines than the `size` commands which are kept.
+        """
+        return self.lines is None or self.lines > max(2 * size, HISTORY_COMPACT_MIN_LINES)
 
-    def __init__(
-        self,
-        name: str,
-        default_value: T.Any,
-        set_show_doc: str,
-        parameter_class: int,
-        help_doc: str = "",
-        enum_sequence: T.Sequence | None = None,
-    ) -> None:
-        self.set_show_doc = set_show_doc
-        self.set_doc = f"Set {self.set_show_doc}."
-        self.show_doc = f"Show {self.set_show_doc}."
-        self.__doc__ = help_doc.strip() or None
-        if enum_sequence:
-            super().__init__(name, gdb.COMMAND_NONE, parameter_class, enum_sequence)
-        else:
-            super().__init__(name, gdb.COMMAND_NONE, parameter_class)
-        self.value = default_value
+    def take_compact_error(self) -> OSError | None:
+        """
+        Return the error of the last compaction once, so the main thread can report it.
+        """
+        error, self._compact_error = self._compact_error, None
+        return error
 
-    def get_set_string(self) -> str:
-        if not self.gep_loaded:
-            return ""
-        svalue = self.value
-        # TODO: Support other type when needed
-        if isinstance(svalue, bool):
-            svalue = "on" if svalue else "off"
-        return f"Set {self.set_show_doc} to {svalue!r}."
+    def compact(self, max_size: int, remove_duplicates: int) -> None:
+        """
+        Start compacting the file in the background if it's not being compacted.
+        """
+        if self._compactor is not None and self._compactor.is_alive():
+            return
+        self._compactor = threading.Thread(
+            target=self._compact, args=(max_size, remove_duplicates), daemon=True
+        )
+        self._compactor.start()
 
-    def get_show_string(self, svalue: T.Any) -> str:
-        if not self.gep_loaded:
-            return ""
-        return f"{self.set_show_doc.capitalize()} is {svalue!r}."
+    def _compact(self, max_size: int, remove_duplicates: int) -> None:
+        tmp_path: str | None = None
+        try:
+            with open(self.filename, "rb") as f:
+                inode = os.fstat(f.fileno()).st_ino
+                data = f.read()
+            data = data[: data.rfind(b"\n") + 1]
+            commands = HistoryStore(
+                filter(None, data.decode("utf-8", "surrogateescape").splitlines()),
+                remove_duplicates,
+            )
+            if max_size >= 0:
+                commands.trim(max_size)
+            fd, tmp_path = tempfile.mkstemp(
+                dir=os.path.dirname(self.filename) or ".", prefix=".gdb_history-"
+            )
+            with os.fdopen(fd, "wb") as tmp_file, self._lock:
+                for command in commands:
+                    tmp_file.write(command.encode("utf-8", "surrogateescape") + b"\n")
+                compacted_size = tmp_file.tell()
+                f = self._lock_file(fcntl.LOCK_EX)
+                try:
+                    if self._inode != inode:
+                        # Another session has compacted the file
+                        return
+                    # Keep the commands which are appended while compacting
+                    f.seek(len(data))
+                    tail = f.read()
+                    tmp_file.write(tail)
+                    tmp_file.flush()
+                    os.fsync(tmp_file.fileno())
+                    os.replace(tmp_path, self.filename)
+                    tmp_path = None
+                    self.lines = len(commands) + tail.count(b"\n")
+                    self._offset = compacted_size + max(self._offset - len(data), 0)
+                    self._inode = os.fstat(tmp_file.fileno()).st_ino
+                    # This also releases the lock, the other sessions will find the file replaced
+                    f.close()
+                    self._file = None
+                finally:
+                    if self._file is not None:
+                        fcntl.flock(self._file, fcntl.LOCK_UN)
+        except OSError as e:
+            self._compact_error = e
+        finally:
+            if tmp_path is not None:
+                try:
+                    os.unlink(tmp_path)
+                except OSError:
+                    pass
 
 
-single_column_tab_complete = UserParameter(
-    "single-column-tab-complete",
-    True,
-    "whether to use single column for tab completion",
-    gdb.PARAM_BOOLEAN,
-)
+class HistoryShard:
+    """
+    The commands which are entered while an executable is debugged, they are in the global history
+    as well, but these are searched first.
 
-UserParameter(
-    "fzf-run-opts",
-    "",
-    "additional options for fzf (used in tab completion or history search)",
-    gdb.PARAM_STRING_NOESCAPE,
-)
+    The commands are saved to `<history filename>.shards/<SHA-1 of the path of the executable>` in
+    the same format as the history file, so the shard of a program is kept after rebuilding it.
+    """
 
-UserParameter(
-    "fzf-preview-opts",
-    "",
-    "additional options for fzf preview window (used in tab completion)",
-    gdb.PARAM_STRING_NOESCAPE,
-)
+    def __init__(
+        self, path: str, filename: str, remove_duplicates: int, frecency: HistoryFrecency
+    ) -> None:
+        self.path = path
+        commands: list[str] = []
+        size, inode = 0, None
+        try:
+            with open(filename, "rb") as f:
+                data = f.read()
+                inode = os.fstat(f.fileno()).st_ino
+            size = len(data)
+            commands = data.decode("utf-8", "surrogateescape").splitlines()
+        except FileNotFoundError:
+            pass
+        self.store = HistoryStore(commands, remove_duplicates)
+        self.journal = HistoryJournal(filename, len(commands), size, inode)
+        self._frecency = frecency
+        # The indexes are built on the first lookup, after the store is trimmed
+        self._prefix_index: HistoryPrefixIndex | None = None
+        self._frecency_index: HistoryPrefixIndex | None = None
 
-if HAS_FZF:
-    # key binding for fzf history search
-    BINDINGS.add("c-r")(fzf_reverse_search)
-    # key binding for fzf tab completion
-    FIFO_INPUT_PATH, FIFO_OUTPUT_PATH = create_preview_fifos()
-    FZF_PRVIEW_CMD = f"echo {{n}} > {FIFO_INPUT_PATH}\ncat {FIFO_OUTPUT_PATH}"
-    BINDINGS.add("c-i")(fzf_tab_autocomplete)
-    # key binding for fzf breakpoint toggle (Alt-t / Option-t)
-    # Also bind \u2020 (†) for macOS terminals where Option sends special characters
-    BINDINGS.add("escape", "t")(fzf_toggle_breakpoint)
-    BINDINGS.add("\u2020")(fzf_toggle_breakpoint)
-    # key binding for fzf breakpoint delete (Alt-x / Option-x)
-    # Also bind \u2248 (≈) for macOS terminals where Option sends special characters
-    BINDINGS.add("escape", "x")(fzf_delete_breakpoint)
-    BINDINGS.add("\u2248")(fzf_delete_breakpoint)
-else:
-    print_warning("Install fzf for better experience with GEP")
+    @property
+    def prefix_index(self) -> HistoryPrefixIndex:
+        if self._prefix_index is None:
+            self._prefix_index = HistoryPrefixIndex(self.store.recent_distinct())
+        return self._prefix_index
+
+    @property
+    def frecency_index(self) -> HistoryPrefixIndex:
+        if self._frecency_index is None:
+            self._frecency_index = HistoryPrefixIndex(
+                self.store.recent_distinct(), self._frecency.priority
+            )
+        return self._frecency_index
+
+    @staticmethod
+    def get_filename(history_filename: str, path: str) -> str:
+        digest = hashlib.sha1(path.encode("utf-8", "surrogateescape")).hexdigest()
+        return os.path.join(history_filename + ".shards", digest)
+
+    def add(self, command: str, remove_duplicates: int) -> None:
+        self.store.append(command, remove_duplicates)
+        if self._prefix_index is not None:
+            self._prefix_index.add(command)
+        if self._frecency_index is not None:
+            self._frecency_index.add(command)
+
+    def remove(self, command: str) -> None:
+        if self._prefix_index is not None:
+            self._prefix_index.remove(command)
+        if self._frecency_index is not None:
+            self._frecency_index.remove(command)
+
+    def trim(self, max_size: int) -> None:
+        if max_size >= 0:
+            self.store.trim(max_size, self.remove)
+
+    def append(self, command: str, remove_duplicates: int, max_size: int, save: bool) -> None:
+        """
+        Add `command`, and append it to the file of the shard if `save` is True.
+        """
+        if save:
+            # The other sessions which debug the same executable might have appended some commands
+            for new_command in self.journal.append(command):
+                self.add(new_command, remove_duplicates)
+        self.add(command, remove_duplicates)
+        self.trim(max_size)
+        if save and self.journal.should_compact(len(self.store)):
+            self.journal.compact(max_size, remove_duplicates)
+
+    def merge_file(self, remove_duplicates: int, max_size: int) -> bool:
+        """
+        Merge the commands which are appended by the other sessions, return whether there are any.
+        """
+        new_commands = self.journal.read_new_commands()
+        for command in new_commands:
+            self.add(command, remove_duplicates)
+        if new_commands:
+            self.trim(max_size)
+        return bool(new_commands)
 
 
 class GDBCommandsHistory(History):
@@ -816,21 +3858,119 @@ class GDBCommandsHistory(History):
     def __init__(self) -> None:
         super().__init__()
         self._base_num = 1
-        self._commands: list[str] = self.load_history_file()
+        self._journal: HistoryJournal | None = None
+        self._ranked_commands_text: str | None = None
+        self._top_commands: tuple[int, list[str]] | None = None
+        self._top_command_set: set[str] | None = None
+        self._text_index: HistoryTextIndex | None = None
+        self.prefix_search: HistoryPrefixSearch | None = None
+        self._shard: HistoryShard | None = None
+        # The number and the size of the commands which are loaded into the prompt by `load`
+        self.loaded_commands = 0
+        self.loaded_nbytes = 0
+        compact = T.cast(bool, gdb.parameter("history-compact"))
+        saved_commands = self.load_history_file(keep_lines=not compact)
+        self._frecency = self.load_frecency_file()
+        # The file might have the duplicates which are removed from the history, replay them
+        self._commands = HistoryStore(saved_commands, self.remove_duplicates, compact)
+        # The indexes are built on the first lookup, after the store is trimmed, and then they are
+        # updated as the commands are stored and trimmed
+        self._prefix_index: HistoryPrefixIndex | None = None
+        self._frecency_index: HistoryPrefixIndex | None = None
         self._trim_to_max_size()
-        atexit.register(self.dump_history_file)
-        # Make prompt_toolkit happy
+        if isinstance(saved_commands, HistoryFileLines):
+            self._journal = HistoryJournal(
+                self.filename, len(saved_commands), saved_commands.size, saved_commands.inode
+            )
+        elif self.filename:
+            self._journal = HistoryJournal(self.filename, 0, 0, None)
+        atexit.register(self.close_history_file)
+        # Make prompt_toolkit happy, it reads the newest commands first
         self._loaded = True
-        self._loaded_strings = self._commands[::-1]
+        self._loaded_strings = HistoryView(self._commands, reverse=True)  # ty: ignore[invalid-assignment]
 
     @property
     def base_num(self) -> int:
         return self._base_num
 
+    @property
+    def store(self) -> HistoryStore:
+        return self._commands
+
+    @property
+    def prefix_index(self) -> HistoryPrefixIndex:
+        if self._prefix_index is None:
+            self._prefix_index = HistoryPrefixIndex(self._recent_distinct())
+        return self._prefix_index
+
+    @property
+    def frecency_index(self) -> HistoryPrefixIndex:
+        if self._frecency_index is None:
+            self._frecency_index = HistoryPrefixIndex(
+                self._recent_distinct(), self._frecency.priority
+            )
+        return self._frecency_index
+
+    @property
+    def text_index(self) -> HistoryTextIndex:
+        if self._text_index is None or self._text_index.is_full:
+            self._text_index = HistoryTextIndex(self._commands.recent_distinct())
+        return self._text_index
+
+    def _recent_distinct(self) -> T.Iterator[str]:
+        # A compact store, or the file archived in a store, decodes new strings every time, so share
+        # one string of each command between the prefix indexes, the stored commands are interned too
+        return map(sys.intern, self._commands.recent_distinct())
+
+    @staticmethod
+    def _intern(command: str) -> str:
+        return sys.intern(command)
+
+    def get_indexes(self) -> dict[str, HistoryPrefixIndex | HistoryTextIndex | None]:
+        """
+        Return the search indexes by their names, None if an index is not built yet.
+        """
+        return {
+            "Prefix index": self._prefix_index,
+            "Frecency index": self._frecency_index,
+            "Text index": self._text_index,
+        }
+
+    def get_index_strings_nbytes(self) -> int:
+        """
+        Return the size of the strings which are kept by the indexes and the frecency counters, but
+        not by the history, each string is counted once.
+        """
+        seen = self._commands.string_ids()
+        size = 0
+        sources: list[T.Iterable[str]] = [self._frecency]
+        sources += [index.iter_commands() for index in self.get_indexes().values() if index]
+        for command in itertools.chain.from_iterable(sources):
+            if id(command) not in seen:
+                seen.add(id(command))
+                size += sys.getsizeof(command)
+        return size
+
+    @property
+    def frecency(self) -> HistoryFrecency:
+        return self._frecency
+
+    @property
+    def shard(self) -> HistoryShard | None:
+        return self._shard
+
     @property
     def filename(self) -> str:
         return T.cast(str, gdb.parameter("history filename"))
 
+    @property
+    def frecency_limit(self) -> int:
+        return T.cast(int, gdb.parameter("history-frecency-limit"))
+
+    @property
+    def per_binary(self) -> bool:
+        return T.cast(bool, gdb.parameter("history-per-binary"))
+
     @property
     def should_save(self) -> bool:
         return T.cast(bool, gdb.parameter("history save"))
@@ -844,81 +3984,320 @@ class GDBCommandsHistory(History):
         return T.cast(int, gdb.parameter("history remove-duplicates"))
 
     @property
-    def commands(self) -> list[str]:
-        return self._commands.copy()
+    def commands(self) -> HistoryView:
+        return HistoryView(self._commands)
 
     def _trim_to_max_size(self) -> None:
         max_size = self.max_size
-        if max_size == 0:
-            self._base_num += len(self._commands)
-            self._commands.clear()
-            return
-        elif max_size < 0:
+        if max_size < 0:
             # This means unlimited history size
             return
-        elif len(self._commands) > max_size:
-            self._base_num += len(self._commands) - max_size
-            self._commands = self._commands[-max_size:]
+        self._base_num += self._commands.trim(max_size, self._on_command_removed)
 
-    def load_history_file(self) -> list[str]:
+    def load_history_file(self, keep_lines: bool = True) -> T.Sequence[str]:
         filename = self.filename
         if not filename:
             return []
-        saved_commands = []
         try:
             if os.path.exists(filename):
-                with open(filename) as f:
-                    for command in f.read().splitlines():
-                        if command:
-                            saved_commands.append(command)
+                return HistoryFileLines(filename, keep_lines)
         except Exception as e:
             print_warning(f"Failed to read history file: {e}")
-        return saved_commands
+        return []
+
+    def load_frecency_file(self) -> HistoryFrecency:
+        filename = self.filename
+        # The commands in the history file are assumed to be used when the file is written last time
+        try:
+            base_time = os.path.getmtime(filename) if filename else time.time()
+        except OSError:
+            base_time = time.time()
+        frecency = HistoryFrecency(base_time)
+        if filename:
+            try:
+                frecency.load(filename + ".frecency")
+            except OSError as e:
+                print_warning(f"Failed to read history frecency file: {e}")
+        return frecency
 
-    def dump_history_file(self) -> None:
-        should_save = self.should_save
-        if not should_save:
+    def write_history_file(self, command: str) -> None:
+        if not self.should_save:
             return
         filename = self.filename
         if not filename:
             return
-        dirpath = os.path.dirname(filename)
+        if self._journal is None or self._journal.filename != filename:
+            # `history filename` is changed, the commands in the new file are not ours
+            self.close_history_file()
+            lines, size, inode = 0, 0, None
+            try:
+                st = os.stat(filename)
+                # Don't read a huge file to count its lines, the compactor counts them in the background
+                lines, size, inode = None, st.st_size, st.st_ino
+            except FileNotFoundError:
+                pass
+            self._journal = HistoryJournal(filename, lines, size, inode)
         try:
-            if dirpath:
-                os.makedirs(dirpath, exist_ok=True)
-            with open(filename, "w") as f:
-                for cmd in self._commands:
-                    f.write(cmd + "\n")
-        except Exception as e:
+            self.merge_commands(self._journal.append(command))
+        except OSError as e:
             print_warning(f"Failed to write history file: {e}")
-            pass
+            return
+        if self._journal.should_compact(len(self._commands)):
+            self._journal.compact(self.max_size, self.remove_duplicates)
+
+    def merge_history_file(self) -> None:
+        """
+        Merge the commands which are appended to the history file by the other GDB sessions.
+        """
+        if self._journal is None or self._journal.filename != self.filename or not self.should_save:
+            return
+        try:
+            self.merge_commands(self._journal.read_new_commands())
+        except OSError as e:
+            print_warning(f"Failed to read history file: {e}")
+
+    def report_compact_errors(self) -> None:
+        """
+        Print the errors of the compactions, they happen in the background while the prompt owns the terminal.
+        """
+        error = self._journal.take_compact_error() if self._journal is not None else None
+        if error is not None:
+            print_warning(f"Failed to compact history file: {error}")
+        error = self._shard.journal.take_compact_error() if self._shard is not None else None
+        if error is not None:
+            print_warning(f"Failed to compact history shard: {error}")
+
+    def merge_commands(self, commands: list[str]) -> None:
+        if not commands:
+            return
+        remove_duplicates = self.remove_duplicates
+        for command in map(self._intern, commands):
+            self._commands.append(command, remove_duplicates)
+            # The other session saves the frecency of its commands by itself
+            self._on_command_added(command, own=False)
+        self._trim_to_max_size()
+
+    def close_history_file(self) -> None:
+        filename = self.filename
+        if filename and self.should_save:
+            try:
+                self._frecency.save(filename + ".frecency")
+            except OSError as e:
+                print_warning(f"Failed to write history frecency file: {e}")
+        self.close_shard()
+        if self._journal is None:
+            return
+        try:
+            self._journal.close()
+        except OSError as e:
+            print_warning(f"Failed to write history file: {e}")
+
+    def update_shard(self) -> None:
+        """
+        Switch to the shard of the current executable, e.g. after `file` or `attach`, and merge the
+        commands which are appended to it by the other sessions.
+        """
+        filename = self.filename
+        path = None
+        if filename and self.per_binary:
+            progspace = gdb.current_progspace()
+            executable = progspace.filename if progspace is not None else None
+            if executable:
+                path = os.path.realpath(executable)
+        shard = self._shard
+        if path is None:
+            if shard is not None:
+                self.close_shard()
+                self._on_history_changed()
+            return
+        shard_filename = HistoryShard.get_filename(filename, path)
+        try:
+            if shard is not None and shard.journal.filename == shard_filename:
+                if self.should_save and shard.merge_file(self.remove_duplicates, self.max_size):
+                    self._on_history_changed()
+                return
+            self.close_shard()
+            self._shard = HistoryShard(path, shard_filename, self.remove_duplicates, self._frecency)
+            self._shard.trim(self.max_size)
+        except OSError as e:
+            print_warning(f"Failed to read history shard: {e}")
+        self._on_history_changed()
+
+    def close_shard(self) -> None:
+        if self._shard is None:
+            return
+        try:
+            self._shard.journal.close()
+        except OSError as e:
+            print_warning(f"Failed to write history shard: {e}")
+        self._shard = None
+
+    def _on_history_changed(self) -> None:
+        self._ranked_commands_text = None
+        self._top_commands = None
+        self._top_command_set = None
+        self.prefix_search = None
+
+    def _on_command_added(self, command: str, own: bool = True) -> None:
+        self._frecency.record(command, own)
+        self._on_history_changed()
+        if self._prefix_index is not None:
+            self._prefix_index.add(command)
+        if self._frecency_index is not None:
+            self._frecency_index.add(command)
+        if self._text_index is not None:
+            self._text_index.add(command)
+
+    def _on_command_removed(self, command: str) -> None:
+        # The trimmed commands are not suggested anymore
+        self._on_history_changed()
+        if self._prefix_index is not None:
+            self._prefix_index.remove(command)
+        if self._frecency_index is not None:
+            self._frecency_index.remove(command)
+        if self._text_index is not None:
+            self._text_index.remove(command)
+
+    def get_top_commands(self) -> list[str]:
+        """
+        Return the distinct commands, the most frecent first, at most `history-frecency-limit` ones.
+        """
+        limit = self.frecency_limit
+        if self._top_commands is None or self._top_commands[0] != limit:
+            # The commands of the current executable come first
+            commands = []
+            if self._shard is not None:
+                commands = self._shard.frecency_index.ranked()
+            shard_commands = set(commands)
+            index = self.frecency_index
+            if limit:
+                others = itertools.islice(index.iter_matches(""), limit + len(commands))
+            else:
+                others = index.ranked()
+            commands += [command for command in others if command not in shard_commands]
+            if limit:
+                del commands[limit:]
+            self._top_commands = (limit, commands)
+            self._top_command_set = None
+        return self._top_commands[1]
+
+    def is_top_command(self, command: str) -> bool:
+        if not self.frecency_limit:
+            return True
+        top_commands = self.get_top_commands()
+        if self._top_command_set is None:
+            self._top_command_set = set(top_commands)
+        return command in self._top_command_set
+
+    def iter_prefix_matches(self, prefix: str) -> T.Iterator[str]:
+        """
+        Iterate the distinct commands which start with `prefix`, the most recently used first, the
+        commands of the current executable come first.
+        """
+        shard_commands = set()
+        if self._shard is not None:
+            for command in self._shard.prefix_index.iter_matches(prefix):
+                shard_commands.add(command)
+                yield command
+        for command in self.prefix_index.iter_matches(prefix):
+            if command not in shard_commands:
+                yield command
+
+    def search_commands(self, query: str, regex: bool = False) -> T.Iterator[str]:
+        """
+        Iterate the distinct commands which contain `query`, or match it if `regex` is True, the
+        most recently used first, the commands of the current executable come first.
+        """
+        shard_commands = set()
+        if self._shard is not None:
+            is_match = get_history_matcher(query, regex)
+            for command in self._shard.store.recent_distinct():
+                if command and is_match(command):
+                    shard_commands.add(command)
+                    yield command
+        for command in self.text_index.search(query, regex):
+            if command not in shard_commands:
+                yield command
+
+    def find_suggestion(self, prefix: str) -> str | None:
+        """
+        Return the most frecent command which starts with `prefix`, the commands of the current
+        executable are preferred.
+        """
+        if self._shard is not None:
+            command = self._shard.frecency_index.best(prefix)
+            if command is not None:
+                return command
+        command = self.frecency_index.best(prefix)
+        if command is None or not self.is_top_command(command):
+            return None
+        return command
+
+    def get_ranked_commands_text(self) -> str:
+        """
+        Return the top commands for fzf, one per line.
+
+        The text is cached until the history is changed, so opening the reverse search again is cheap.
+        """
+        if self._ranked_commands_text is None:
+            lines = "\n".join(self.get_top_commands())
+            self._ranked_commands_text = lines + "\n" if lines else ""
+        return self._ranked_commands_text
 
     def load_history_strings(self) -> T.Iterable[str]:
         yield from reversed(self._commands)
 
+    async def load(self) -> T.AsyncGenerator[str, None]:
+        # prompt_toolkit copies the loaded commands into the buffer for every prompt, so only the newest chunk
+        # is loaded, and an older chunk is loaded when the user browses near the oldest loaded command
+        buffer = get_app().current_buffer
+        load_more = asyncio.Event()
+
+        def on_text_changed(buffer: Buffer) -> None:
+            if buffer.working_index < HISTORY_LOAD_CHUNK_SIZE // 2:
+                load_more.set()
+
+        self.loaded_commands = self.loaded_nbytes = 0
+        buffer.on_text_changed += on_text_changed
+        try:
+            for idx, command in enumerate(reversed(self._commands)):
+                if idx % HISTORY_LOAD_CHUNK_SIZE == 0 and idx > 0:
+                    await load_more.wait()
+                    load_more.clear()
+                self.loaded_commands += 1
+                self.loaded_nbytes += sys.getsizeof(command)
+                yield command
+        finally:
+            buffer.on_text_changed -= on_text_changed
+
+    def get_strings(self) -> HistoryView:  # ty: ignore[invalid-method-override]
+        # Avoid copying the whole history on every call
+        return HistoryView(self._commands)
+
     def append_string(self, string: str) -> None:
         # We will handle the append logic by ourselves
         pass
 
     def store_string(self, string: str) -> None:
-        removal = self.remove_duplicates
-        if removal != 0:
-            stop_idx = max(0, len(self._commands) - removal) if removal > 0 else 0
-            for idx in range(len(self._commands) - 1, stop_idx - 1, -1):
-                if self._commands[idx] == string:
-                    del self._commands[idx]
-                    break
-
-        self._commands.append(string)
+        # The commands of the other sessions are entered before this one
+        self.merge_history_file()
+        string = self._intern(string)
+        self._commands.append(string, self.remove_duplicates)
+        self._on_command_added(string)
         self._trim_to_max_size()
-        # Make prompt_toolkit happy
-        self._loaded_strings = self._commands[::-1]
+        self.write_history_file(string)
+        if self._shard is not None:
+            try:
+                self._shard.append(string, self.remove_duplicates, self.max_size, self.should_save)
+            except OSError as e:
+                print_warning(f"Failed to write history shard: {e}")
 
 
 class ShowCommands(gdb.Command):
     """Show the history of commands you typed.
     You can supply a command number to start with, or a '+' to start after
     the previous command number shown.
+    With /REGEX/, the latest commands which match REGEX are shown.
     """
 
     HIST_PRINT = 10
@@ -933,6 +4312,9 @@ class ShowCommands(gdb.Command):
         base_num = self._history.base_num
         argument = argument.strip()
 
+        if len(argument) >= 2 and argument.startswith("/") and argument.endswith("/"):
+            self._show_matches(argument[1:-1])
+            return
         if not argument:
             start = len(commands) - self.HIST_PRINT
         elif argument == "+":
@@ -953,6 +4335,76 @@ class ShowCommands(gdb.Command):
 
         self._next_offset = end
 
+    def _show_matches(self, pattern: str) -> None:
+        try:
+            matches = self._history.text_index.search(pattern, regex=True)
+            pending = set(itertools.islice(matches, self.HIST_PRINT))
+        except re.error as e:
+            raise gdb.GdbError(f"Invalid regex: {e}")
+        # The matches are distinct commands, find their latest numbers
+        commands = self._history.commands
+        found = []
+        for i, command in zip(range(len(commands) - 1, -1, -1), reversed(commands)):
+            if not pending:
+                break
+            if command in pending:
+                pending.remove(command)
+                found.append(i)
+        base_num = self._history.base_num
+        for i in reversed(found):
+            print(f"{i + base_num:5d}  {commands[i]}")
+
+
+class MemoryCommand(gdb.Command):
+    """Show the approximate memory usage of GEP's history and indexes.
+    Usage: gep memory
+    The memory-mapped files are reported separately, they are paged in by the kernel on demand.
+    """
+
+    def __init__(self, history: GDBCommandsHistory) -> None:
+        super().__init__("gep memory", gdb.COMMAND_SUPPORT, gdb.COMPLETE_NONE)
+        self._history = history
+
+    def invoke(self, argument: str, from_tty: bool) -> None:
+        if argument.strip():
+            raise gdb.GdbError(f"Invalid argument: {argument!r}")
+        store = self._history.store
+        backend = "compact" if store.compact else "list"
+        print(f"History:          {len(store)} commands, {format_size(store.nbytes)} ({backend})")
+        loaded_size = format_size(self._history.loaded_nbytes)
+        print(f"Prompt history:   {self._history.loaded_commands} commands, {loaded_size}")
+        frecency = self._history.frecency
+        print(f"Frecency:         {len(frecency)} commands, {format_size(frecency.nbytes)}")
+        for name, index in self._history.get_indexes().items():
+            label = f"{name}:".ljust(18)
+            if index is None:
+                print(f"{label}not built")
+            else:
+                print(f"{label}{len(index)} commands, {format_size(index.nbytes)}")
+        strings_size = format_size(self._history.get_index_strings_nbytes())
+        print(f"Index strings:    {strings_size}")
+        shard = self._history.shard
+        if shard is not None:
+            shard_size = format_size(shard.store.nbytes)
+            print(f"History shard:    {len(shard.store)} commands, {shard_size} ({shard.path})")
+        shards = SYMBOL_INDEX_MANAGER.shards
+        mapped_size = sum(shard.nbytes for shard in shards)
+        print(f"Symbol index:     {len(shards)} shards, {format_size(mapped_size)} mapped")
+        print(f"Completion cache: {len(COMPLETION_CACHE)} entries")
+
+
+def format_size(size: float) -> str:
+    """
+    Format a size in bytes, e.g. 1536 -> 1.5 KiB
+    """
+    if size < 1024:
+        return f"{size:.0f} B"
+    for unit in ("KiB", "MiB", "GiB"):
+        size /= 1024
+        if size < 1024:
+            break
+    return f"{size:.1f} {unit}"
+
 
 class GDBCompleter(Completer):
     """
@@ -972,24 +4424,55 @@ class GDBCompleter(Completer):
         if not all_completions:
             return
 
+        word = re.split(r"\W+", target_text)[-1]
         for completion in all_completions:
+            # prompt_toolkit only evaluates the display_meta of the completions it renders
+            display_meta = (
+                None
+                if not should_get_all_help_docs
+                else functools.partial(safe_get_help_docs, completion)
+            )
             if not completion.startswith(target_text):
-                # TODO/FIXME: This might cause some missing of completion for something like:
+                # The word before cursor is replaced by the completion, e.g.
                 # (gdb) complete b fun
                 # b foo::B::func()
                 # b funlockfile
-                # b foo::B::func() will be ignored
+                word_idx_in_completion = cursor_idx_in_completion - len(word)
+                if not completion.startswith(target_text[:word_idx_in_completion]):
+                    continue
+                completion = completion[word_idx_in_completion:]
+                yield Completion(
+                    completion,
+                    start_position=-len(word),
+                    display=completion,
+                    display_meta=display_meta,
+                )
                 continue
-            display_meta = (
-                None if not should_get_all_help_docs else safe_get_help_docs(completion) or None
-            )
             # remove some prefix of raw completion
             completion = completion[cursor_idx_in_completion:]
             # display readable completion based on the text before cursor
-            display = re.split(r"\W+", target_text)[-1] + completion
+            display = word + completion
             yield Completion(completion, display=display, display_meta=display_meta)
 
 
+class HistoryAutoSuggest(AutoSuggest):
+    """
+    Suggest the rest of the most frecent command which starts with the current line, with the
+    frecency index of the history
+    """
+
+    def get_suggestion(self, buffer: Buffer, document: Document) -> Suggestion | None:
+        # Consider only the last line for the suggestion
+        text = document.text.rsplit("\n", 1)[-1]
+        if not text.strip() or not isinstance(buffer.history, GDBCommandsHistory):
+            return None
+        command = buffer.history.find_suggestion(text)
+        if command is None:
+            return None
+        # Only the rest of the first line of a multi-line command is suggested
+        return Suggestion(command[len(text) :].split("\n", 1)[0])
+
+
 def emulate_prompt_hook(current_prompt: str) -> str:
     """
     Emulate the gdb.prompt_hook behavior
@@ -1036,7 +4519,9 @@ def emulate_prompt(session: PromptSession, current_prompt: str, gdb_history: His
     Emulate the prompt after executing gdb.prompt_hook
     """
     # remove SOH (\001) and STX (\002) for prompt_toolkit
-    full_cmd = session.prompt(ANSI(current_prompt.replace("\001", "").replace("\002", "")))
+    full_cmd = GDB_MAIN_THREAD.prompt(
+        session, ANSI(current_prompt.replace("\001", "").replace("\002", ""))
+    )
     main_cmd = re.split(r"\W+", full_cmd.strip())[0]
     quit_input_in_multiline_mode = False
     is_repeat = False
@@ -1063,7 +4548,7 @@ def emulate_prompt(session: PromptSession, current_prompt: str, gdb_history: His
             while stack_size > 0:
                 full_cmd += "\n"
                 try:
-                    new_line = session.prompt(">".rjust(stack_size))
+                    new_line = GDB_MAIN_THREAD.prompt(session, ">".rjust(stack_size))
                 except EOFError:
                     full_cmd += "end"
                     stack_size -= 1
@@ -1096,6 +4581,17 @@ try: gdb.execute({full_cmd!r}, from_tty=True)
 except gdb.error as e: print(e)
 """
         )
+        if is_command_defining_command(full_cmd):
+            COMPLETION_CACHE.invalidate()
+            HELP_DOCS_INDEX.mark_stale(full_cmd)
+
+
+def is_command_defining_command(full_cmd: str) -> bool:
+    """
+    Check if `full_cmd` might define new GDB commands, e.g. `define`, `python-interactive`.
+    """
+    words = full_cmd.split(maxsplit=1)
+    return bool(words) and words[0] in COMMAND_DEFINING_COMMANDS
 
 
 def gep_prompt(current_prompt: str) -> None:
@@ -1103,10 +4599,10 @@ def gep_prompt(current_prompt: str) -> None:
     UserParameter.gep_loaded = True
     gdb_history = GDBCommandsHistory()
     ShowCommands(gdb_history)
+    MemoryCommand(gdb_history)
     session: PromptSession = PromptSession(
         history=gdb_history,
-        enable_history_search=True,
-        auto_suggest=AutoSuggestFromHistory(),
+        auto_suggest=HistoryAutoSuggest(),
         completer=GDBCompleter() if not HAS_FZF else None,
         complete_style=CompleteStyle.COLUMN
         if single_column_tab_complete.value
@@ -1117,6 +4613,12 @@ def gep_prompt(current_prompt: str) -> None:
     )
     while True:
         current_prompt = emulate_prompt_hook(current_prompt)
+        if gdb.parameter("symbol-index"):
+            # Index the symbols while the user is typing
+            SYMBOL_INDEX_MANAGER.start()
+        gdb_history.merge_history_file()
+        gdb_history.update_shard()
+        gdb_history.report_compact_errors()
         try:
             emulate_prompt(session, current_prompt, gdb_history)
         except KeyboardInterrupt:
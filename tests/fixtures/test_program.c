@@ -2,6 +2,10 @@
 
 int global_var = 42;
 
+enum color { RED, GREEN, BLUE };
+typedef int counter_t;
+enum color global_color = RED;
+
 int add(int a, int b) {
     return a + b;
 }
@@ -14,6 +18,11 @@ void print_result(int value) {
     printf("Result: %d\n", value);
 }
 
+counter_t count_calls(void) {
+    static counter_t calls = 0;
+    return ++calls;
+}
+
 int main(void) {
     int x = 10;
     int y = 20;
@@ -21,5 +30,6 @@ int main(void) {
     int product = multiply(x, y);
     print_result(sum);
     print_result(product);
+    print_result(count_calls());
     return 0;
 }
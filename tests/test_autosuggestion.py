@@ -33,3 +33,13 @@ def test_autosuggestion_empty_history(gdb_session: GDBSession) -> None:
     gdb_session.start(histories=[])
     gdb_session.send_literal("print 1")
     assert b"(gdb) print 1" == gdb_session.capture_pane(with_color=True)
+
+
+def test_autosuggestion_skips_trimmed_commands(gdb_session: GDBSession) -> None:
+    gdb_session.start(gdb_args=["-ex", "set history size 2"], histories=["print 12", "print 34"])
+    # `print 12` is trimmed from the history
+    gdb_session.send_literal("print 5")
+    gdb_session.send_key("Enter")
+    gdb_session.clear_pane()
+    gdb_session.send_literal("print 1")
+    assert b"(gdb) print 1" == gdb_session.capture_pane(with_color=True)
@@ -2,6 +2,8 @@ import re
 from pathlib import Path
 
 from conftest import GDB_HISTORY_NAME
+from conftest import GDBINIT_NAME
+from conftest import TEST_PROGRAM_C
 from conftest import GDBSession
 
 
@@ -39,6 +41,19 @@ def test_show_commands_shows_less_than_ten_commands(gdb_session: GDBSession) ->
     assert _numbered_command(5, "show commands") in pane_content
 
 
+def test_show_commands_skips_empty_lines_of_history_file(gdb_session: GDBSession) -> None:
+    gdb_session.start(histories=["", "print 1", "", "", "print 2", ""])
+
+    gdb_session.send_literal("show commands")
+    gdb_session.send_key("Enter")
+    pane_content = gdb_session.capture_pane()
+
+    assert len(_history_output_lines(pane_content)) == 3
+    assert _numbered_command(1, "print 1") in pane_content
+    assert _numbered_command(2, "print 2") in pane_content
+    assert _numbered_command(3, "show commands") in pane_content
+
+
 def test_show_commands_shows_ten_commands_with_offset(gdb_session: GDBSession) -> None:
     gdb_session.start(histories=[f"print {i}" for i in range(1, 26)])
 
@@ -82,6 +97,39 @@ def test_show_commands_shows_less_than_ten_commands_with_offset(gdb_session: GDB
     assert _numbered_command(8, "show commands 5") in pane_content
 
 
+def test_show_commands_filters_by_regex(gdb_session: GDBSession) -> None:
+    gdb_session.start(histories=[f"print {i}" for i in range(1, 26)] + ["print 2"])
+
+    gdb_session.send_literal("show commands /^print 2/")
+    gdb_session.send_key("Enter")
+    pane_content = gdb_session.capture_pane()
+
+    # Only the latest "print 2" is shown
+    assert len(_history_output_lines(pane_content)) == 7
+    for i in range(20, 26):
+        assert _numbered_command(i, f"print {i}") in pane_content
+    assert _numbered_command(26, "print 2") in pane_content
+    assert _numbered_command(2, "print 2") not in pane_content
+
+
+def test_show_commands_filters_by_regex_with_escaped_characters(gdb_session: GDBSession) -> None:
+    gdb_session.start(histories=["print A", "print B", "print 41"])
+
+    # \x41 and \101 are "A", not the digits after the escape
+    gdb_session.send_literal("show commands /\\x41/")
+    gdb_session.send_key("Enter")
+    pane_content = gdb_session.capture_pane()
+    assert _numbered_command(1, "print A") in pane_content
+    assert _numbered_command(3, "print 41") not in pane_content
+
+    gdb_session.clear_pane()
+    gdb_session.send_literal("show commands /\\101/")
+    gdb_session.send_key("Enter")
+    pane_content = gdb_session.capture_pane()
+    assert _numbered_command(1, "print A") in pane_content
+    assert _numbered_command(3, "print 41") not in pane_content
+
+
 def test_show_commands_plus_continues_after_previous_window(
     gdb_session: GDBSession,
 ) -> None:
@@ -295,6 +343,101 @@ def test_history_save_off() -> None:
     assert new_history[2] == "print 3"
 
 
+def test_history_per_binary_saves_shard() -> None:
+    gdb_session = GDBSession()
+    gdb_session.start(
+        gdb_args=[TEST_PROGRAM_C, "-ex", "set history save on", "-ex", "set history-per-binary on"],
+        histories=["print 1"],
+    )
+    gdb_session.send_literal("print 2")
+    gdb_session.send_key("Enter")
+
+    gdb_session.stop()
+    shards = list((Path(gdb_session.tmpdir.name) / f"{GDB_HISTORY_NAME}.shards").iterdir())
+    new_history = (Path(gdb_session.tmpdir.name) / GDB_HISTORY_NAME).read_text().splitlines()
+    shard_history = shards[0].read_text().splitlines()
+    gdb_session.exit()
+
+    # The command is in both the global history and the shard of the program
+    assert new_history == ["print 1", "print 2"]
+    assert len(shards) == 1
+    assert shard_history == ["print 2"]
+
+
+def _share_history_file(gdb_session: GDBSession, other_session: GDBSession) -> Path:
+    """
+    Make `other_session` use the history file of `gdb_session`, it must be set before GEP is loaded.
+    """
+    history_path = Path(gdb_session.tmpdir.name) / GDB_HISTORY_NAME
+    gdbinit_path = Path(other_session.tmpdir.name) / GDBINIT_NAME
+    gdbinit_path.write_text(f"set history filename {history_path}\n" + gdbinit_path.read_text())
+    return history_path
+
+
+def test_history_file_is_shared_between_sessions(gdb_session: GDBSession) -> None:
+    with GDBSession() as other_session:
+        _share_history_file(gdb_session, other_session)
+        gdb_session.start(gdb_args=["-ex", "set history save on"], histories=["print 1"])
+        other_session.start(gdb_args=["-ex", "set history save on"])
+
+        # Each command is appended to the file as it is entered, and tailed by the other session
+        other_session.send_literal("print 2")
+        other_session.send_key("Enter")
+        gdb_session.send_literal("print 3")
+        gdb_session.send_key("Enter")
+
+        other_session.clear_pane()
+        other_session.send_literal("show commands")
+        other_session.send_key("Enter")
+        pane_content = other_session.capture_pane()
+        assert _numbered_command(2, "print 2") in pane_content
+        assert _numbered_command(3, "print 3") in pane_content
+        assert _numbered_command(4, "show commands") in pane_content
+
+        gdb_session.clear_pane()
+        gdb_session.send_literal("show commands")
+        gdb_session.send_key("Enter")
+        pane_content = gdb_session.capture_pane()
+        assert len(_history_output_lines(pane_content)) == 5
+        for i in range(1, 4):
+            assert _numbered_command(i, f"print {i}") in pane_content
+        assert _numbered_command(4, "show commands") in pane_content
+        assert _numbered_command(5, "show commands") in pane_content
+
+        # The file is written before the sessions exit
+        new_history = (Path(gdb_session.tmpdir.name) / GDB_HISTORY_NAME).read_text().splitlines()
+        assert new_history == ["print 1", "print 2", "print 3", "show commands", "show commands"]
+
+
+def test_history_file_compaction_keeps_appended_commands(gdb_session: GDBSession) -> None:
+    with GDBSession() as other_session:
+        history_path = _share_history_file(gdb_session, other_session)
+        gdb_session.start(
+            gdb_args=["-ex", "set history save on", "-ex", "set history size 100"],
+            histories=[f"print {i}" for i in range(1, 2001)],
+        )
+        other_session.start(gdb_args=["-ex", "set history save on"])
+
+        # The file has much more lines than the history size, so it's compacted in the background
+        gdb_session.send_literal("print first")
+        gdb_session.send_key("Enter")
+        # The other session finds the file replaced, and appends to the new one
+        other_session.send_literal("print second")
+        other_session.send_key("Enter")
+        gdb_session.send_literal("print third")
+        gdb_session.send_key("Enter")
+
+        new_history = history_path.read_text().splitlines()
+        assert len(new_history) == 102
+        assert new_history[0] == "print 1902"
+        assert new_history[-4:] == ["print 2000", "print first", "print second", "print third"]
+
+        gdb_session.clear_pane()
+        gdb_session.send_literal("show commands")
+        gdb_session.send_key("Enter")
+        assert b"print second" in gdb_session.capture_pane()
+
+
 def test_truncation_of_loaded_history(gdb_session: GDBSession) -> None:
     history_size = 256
     gdb_session.start(
@@ -334,3 +477,64 @@ def test_truncation_of_loaded_history(gdb_session: GDBSession) -> None:
             assert _numbered_command(i, "show commands 1") in pane_content
         else:
             assert _numbered_command(i, f"print {i}") in pane_content
+
+
+def test_gep_memory_reports_history(gdb_session: GDBSession) -> None:
+    gdb_session.start(histories=[f"print {i}" for i in range(1, 4)])
+
+    gdb_session.clear_pane()
+    gdb_session.send_literal("gep memory")
+    gdb_session.send_key("Enter")
+    pane_content = gdb_session.capture_pane()
+
+    assert b"History:          4 commands" in pane_content
+    assert b"(list)" in pane_content
+
+
+def test_gep_memory_reports_compact_history(gdb_session: GDBSession) -> None:
+    gdb_session.start(
+        gdb_args=["-ex", "set history-compact on"], histories=[f"print {i}" for i in range(1, 4)]
+    )
+
+    gdb_session.clear_pane()
+    gdb_session.send_literal("gep memory")
+    gdb_session.send_key("Enter")
+    pane_content = gdb_session.capture_pane()
+
+    assert b"History:          4 commands" in pane_content
+    assert b"(compact)" in pane_content
+
+
+def test_gep_memory_reports_indexes_once_they_are_built(gdb_session: GDBSession) -> None:
+    gdb_session.start(histories=[f"print {i}" for i in range(1, 4)])
+
+    gdb_session.clear_pane()
+    gdb_session.send_literal("gep memory")
+    gdb_session.send_key("Enter")
+    pane_content = gdb_session.capture_pane()
+
+    # The indexes are built on the first lookup
+    assert b"Text index:       not built" in pane_content
+
+    gdb_session.send_literal("show commands /print/")
+    gdb_session.send_key("Enter")
+    gdb_session.clear_pane()
+    gdb_session.send_literal("gep memory")
+    gdb_session.send_key("Enter")
+    pane_content = gdb_session.capture_pane()
+
+    assert re.search(rb"Text index:       \d+ commands", pane_content)
+    assert b"Index strings:" in pane_content
+
+
+def test_gep_memory_reports_newest_chunk_loaded_into_prompt(gdb_session: GDBSession) -> None:
+    gdb_session.start(histories=[f"print {i}" for i in range(1, 3001)])
+
+    gdb_session.clear_pane()
+    gdb_session.send_literal("gep memory")
+    gdb_session.send_key("Enter")
+    pane_content = gdb_session.capture_pane()
+
+    # The older commands are only loaded when they are browsed
+    assert b"History:          3001 commands" in pane_content
+    assert b"Prompt history:   1024 commands" in pane_content
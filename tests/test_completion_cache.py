@@ -0,0 +1,68 @@
+from conftest import GDBSession
+
+
+def _show_cache_stats(gdb_session: GDBSession) -> bytes:
+    gdb_session.clear_pane()
+    gdb_session.send_literal("gep completion-cache")
+    gdb_session.send_key("Enter")
+    return gdb_session.capture_pane()
+
+
+def test_completion_cache_reuses_results(gdb_session: GDBSession) -> None:
+    gdb_session.start()
+    gdb_session.send_literal("info ")
+    gdb_session.send_key("Tab")
+    gdb_session.send_key("Escape")
+    gdb_session.send_key("Tab")
+    gdb_session.send_key("Escape")
+    gdb_session.send_key("C-u")
+    pane_content = _show_cache_stats(gdb_session)
+    assert b"Hits:       1" in pane_content
+    assert b"Misses:     1" in pane_content
+
+
+def test_completion_cache_clear(gdb_session: GDBSession) -> None:
+    gdb_session.start()
+    gdb_session.send_literal("info ")
+    gdb_session.send_key("Tab")
+    gdb_session.send_key("Escape")
+    gdb_session.send_key("C-u")
+    gdb_session.send_literal("gep completion-cache clear")
+    gdb_session.send_key("Enter")
+    pane_content = _show_cache_stats(gdb_session)
+    assert b"Entries:    0/128" in pane_content
+
+
+def test_completion_cache_refines_extended_query(gdb_session: GDBSession) -> None:
+    gdb_session.start()
+    gdb_session.send_literal("info b")
+    gdb_session.send_key("Tab")
+    gdb_session.send_key("Escape")
+    gdb_session.send_literal("r")
+    gdb_session.send_key("Tab")
+    assert b"(gdb) info breakpoints" == gdb_session.capture_pane()
+    gdb_session.send_key("C-u")
+    pane_content = _show_cache_stats(gdb_session)
+    assert b"Refined:    1" in pane_content
+    assert b"Misses:     1" in pane_content
+
+
+def test_completion_cache_skips_convenience_variables(gdb_session: GDBSession) -> None:
+    gdb_session.start()
+    gdb_session.send_literal("set $gep_first = 1")
+    gdb_session.send_key("Enter")
+    gdb_session.clear_pane()
+    gdb_session.send_literal("p $gep_f")
+    gdb_session.send_key("Tab")
+    assert b"(gdb) p $gep_first" == gdb_session.capture_pane()
+    gdb_session.send_key("C-u")
+
+    # A new convenience variable should be completed without clearing the cache
+    gdb_session.send_literal("set $gep_fresh = 2")
+    gdb_session.send_key("Enter")
+    gdb_session.clear_pane()
+    gdb_session.send_literal("p $gep_f")
+    gdb_session.send_key("Tab")
+    pane_content = gdb_session.capture_pane()
+    assert b"$gep_first" in pane_content
+    assert b"$gep_fresh" in pane_content
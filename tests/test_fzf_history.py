@@ -68,3 +68,15 @@ def test_fzf_history_escape_cancels(gdb_session: GDBSession) -> None:
     assert b"2/2" in gdb_session.capture_pane()
     gdb_session.send_key("Escape")
     assert b"(gdb)" == gdb_session.capture_pane()
+
+
+def test_fzf_history_ranks_frequent_commands_first(gdb_session: GDBSession) -> None:
+    gdb_session.start(histories=["print 10", "print 20"])
+    for _ in range(3):
+        gdb_session.send_literal("print 10")
+        gdb_session.send_key("Enter")
+    gdb_session.send_literal("print 20")
+    gdb_session.send_key("Enter")
+    gdb_session.clear_pane()
+    gdb_session.send_key("C-r")
+    assert Fzf.POINTER + b" print 10" in gdb_session.capture_pane()
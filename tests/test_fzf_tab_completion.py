@@ -147,6 +147,60 @@ def test_fzf_tab_cpp_completion_preserves_prefix(gdb_session: GDBSession) -> Non
     assert b"(gdb) b foo::B::testing()" == pane_content
 
 
+def test_fzf_tab_cpp_completion_matches_unqualified_name(gdb_session: GDBSession) -> None:
+    """
+    Test that a word matches the unqualified part of C++ names, e.g. `b testi` -> `foo::B::testing()`.
+    """
+    gdb_session.start(gdb_args=[TEST_PROGRAM_CPP])
+    # Let GEP index the symbols of the program
+    gdb_session.send_key("Enter")
+    gdb_session.clear_pane()
+
+    gdb_session.send_literal("b testi")
+    gdb_session.send_key("Tab")
+    assert b"(gdb) b foo::B::testing()" == gdb_session.capture_pane()
+
+    gdb_session.send_key("C-u")
+    gdb_session.send_literal("b B::test")
+    gdb_session.send_key("Tab")
+    assert b"(gdb) b foo::B::testing()" == gdb_session.capture_pane()
+
+
+def test_fzf_tab_completes_names_which_are_not_elf_symbols(gdb_session: GDBSession) -> None:
+    """
+    Test that GDB completes the enumerators and typedefs, which the symbol index doesn't know.
+    """
+    gdb_session.start(gdb_args=[TEST_PROGRAM_C])
+    # Let GEP index the symbols of the program
+    gdb_session.send_key("Enter")
+    gdb_session.clear_pane()
+
+    gdb_session.send_literal("p GRE")
+    gdb_session.send_key("Tab")
+    assert b"(gdb) p GREEN" == gdb_session.capture_pane()
+
+    gdb_session.send_key("C-u")
+    gdb_session.send_literal("p (counter_")
+    gdb_session.send_key("Tab")
+    assert b"(gdb) p (counter_t" == gdb_session.capture_pane()
+
+
+def test_fzf_tab_skips_elf_local_symbols_in_expressions(gdb_session: GDBSession) -> None:
+    """
+    Test that the ELF local symbols, e.g. `calls.0` of a static variable, are not completed.
+    """
+    gdb_session.start(gdb_args=[TEST_PROGRAM_C])
+    # Let GEP index the symbols of the program
+    gdb_session.send_key("Enter")
+    gdb_session.clear_pane()
+
+    gdb_session.send_literal("p call")
+    gdb_session.send_key("Tab")
+    pane_content = gdb_session.capture_pane()
+    assert b"calls.0" not in pane_content
+    gdb_session.send_key("Escape")
+
+
 def test_fzf_tab_quoted_symbol_completion(gdb_session: GDBSession) -> None:
     """
     Test completion of quoted symbols includes closing quote (PR #15 fix).
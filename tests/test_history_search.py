@@ -0,0 +1,33 @@
+from conftest import Ansi
+from conftest import GDBSession
+
+
+def test_history_search_up_shows_matches_newest_first(gdb_session: GDBSession) -> None:
+    gdb_session.start(histories=["print 12", "info registers", "print 34", "print 12"])
+    gdb_session.send_literal("print")
+    gdb_session.send_key("Up")
+    assert b"(gdb) print 12" == gdb_session.capture_pane()
+    gdb_session.send_key("Up")
+    assert b"(gdb) print 34" == gdb_session.capture_pane()
+    # The search stops at the oldest match
+    gdb_session.send_key("Up")
+    assert b"(gdb) print 34" == gdb_session.capture_pane()
+
+
+def test_history_search_down_restores_original_text(gdb_session: GDBSession) -> None:
+    gdb_session.start(histories=["print 12", "info registers", "print 34"])
+    gdb_session.send_literal("print")
+    gdb_session.send_key("Up")
+    gdb_session.send_key("Up")
+    assert b"(gdb) print 12" == gdb_session.capture_pane()
+    gdb_session.send_key("Down")
+    assert b"(gdb) print 34" == gdb_session.capture_pane()
+    gdb_session.send_key("Down")
+    assert b"(gdb) print" + Ansi.suggestion(b" 34") == gdb_session.capture_pane(with_color=True)
+
+
+def test_history_search_no_match(gdb_session: GDBSession) -> None:
+    gdb_session.start(histories=["print 12", "print 34"])
+    gdb_session.send_literal("info")
+    gdb_session.send_key("Up")
+    assert b"(gdb) info" == gdb_session.capture_pane()
@@ -0,0 +1,70 @@
+from conftest import GDBSession
+
+
+def _run_python(gdb_session: GDBSession, expression: str) -> bytes:
+    gdb_session.clear_pane()
+    gdb_session.send_literal(f"python print({expression})")
+    gdb_session.send_key("Enter")
+    return gdb_session.capture_pane()
+
+
+def _run_python_block(gdb_session: GDBSession, lines: list[str]) -> None:
+    gdb_session.send_literal("python")
+    gdb_session.send_key("Enter")
+    for line in lines + ["end"]:
+        gdb_session.send_literal(line)
+        gdb_session.send_key("Enter")
+
+
+def test_call_from_main_thread_runs_inline(gdb_session: GDBSession) -> None:
+    gdb_session.start()
+    pane_content = _run_python(
+        gdb_session, "GDB_MAIN_THREAD.call(threading.get_ident) == threading.get_ident()"
+    )
+    assert b"True" in pane_content
+
+
+def test_call_from_thread_runs_while_prompt_waits(gdb_session: GDBSession) -> None:
+    gdb_session.start()
+    # The call is made after the prompt is back and waiting for input
+    gdb_session.send_literal(
+        "python CALLS = []; threading.Timer(0.5, lambda: "
+        "CALLS.append(GDB_MAIN_THREAD.call(threading.get_ident))).start()"
+    )
+    gdb_session.send_key("Enter")
+    pane_content = _run_python(gdb_session, "CALLS == [threading.main_thread().ident]")
+    assert b"True" in pane_content
+
+
+def test_call_from_thread_runs_while_main_thread_waits_in_worker(
+    gdb_session: GDBSession,
+) -> None:
+    gdb_session.start()
+    pane_content = _run_python(
+        gdb_session,
+        "GDB_MAIN_THREAD.run_in_worker(lambda: GDB_MAIN_THREAD.call(threading.get_ident))"
+        " == threading.get_ident()",
+    )
+    assert b"True" in pane_content
+
+
+def test_call_from_thread_times_out_and_never_runs_late(gdb_session: GDBSession) -> None:
+    gdb_session.start()
+    # The main thread is busy joining the thread, so the call times out
+    _run_python_block(
+        gdb_session,
+        [
+            "def call_late():",
+            "    try:",
+            "        GDB_MAIN_THREAD.call(CALLS.append, 'late', timeout=0.1)",
+            "    except FutureTimeoutError:",
+            "        CALLS.append('timeout')",
+            "CALLS = []",
+            "thread = threading.Thread(target=call_late)",
+            "thread.start()",
+            "thread.join()",
+        ],
+    )
+    # The prompt ran the pending calls meanwhile, the cancelled one was skipped
+    pane_content = _run_python(gdb_session, "CALLS")
+    assert b"['timeout']" in pane_content
@@ -0,0 +1,79 @@
+from conftest import GDBINIT_GEP_PY_PATH
+from conftest import TEST_PROGRAM_C
+from conftest import TEST_PROGRAM_CPP
+from conftest import GDBSession
+
+
+def _run_python(gdb_session: GDBSession, expression: str) -> bytes:
+    gdb_session.clear_pane()
+    gdb_session.send_literal(f"python print({expression})")
+    gdb_session.send_key("Enter")
+    return gdb_session.capture_pane()
+
+
+def test_read_elf_symbols_reads_names_and_filenames(gdb_session: GDBSession) -> None:
+    gdb_session.start()
+    pane_content = _run_python(
+        gdb_session,
+        f"sorted({{'add', 'global_var', 'main', 'printf'}} & set(read_elf_symbols({TEST_PROGRAM_C!r})[0]))",
+    )
+    # `printf` is not defined in the program
+    assert b"['add', 'global_var', 'main']" in pane_content
+
+    pane_content = _run_python(
+        gdb_session, f"'test_program.c' in read_elf_symbols({TEST_PROGRAM_C!r})[1]"
+    )
+    assert b"True" in pane_content
+
+
+def test_read_elf_symbols_rejects_non_elf_files(gdb_session: GDBSession) -> None:
+    gdb_session.start()
+    pane_content = _run_python(gdb_session, f"read_elf_symbols({str(GDBINIT_GEP_PY_PATH)!r})")
+    assert b"is not an ELF file" in pane_content
+
+
+def test_demangle_symbol_names(gdb_session: GDBSession) -> None:
+    gdb_session.start()
+    pane_content = _run_python(
+        gdb_session, "demangle_symbol_names(['_ZN3foo1B7testingEv', 'main'])"
+    )
+    assert b"['foo::B::testing()', 'main']" in pane_content
+
+
+def test_build_elf_symbol_index_completes_unqualified_names(gdb_session: GDBSession) -> None:
+    gdb_session.start()
+    pane_content = _run_python(
+        gdb_session, f"build_elf_symbol_index({TEST_PROGRAM_CPP!r}).complete('testi')"
+    )
+    assert b"['foo::B::testing()']" in pane_content
+
+
+def _wait_for_symbol_index(gdb_session: GDBSession) -> None:
+    gdb_session.send_literal(
+        "python while not SYMBOL_INDEX_MANAGER.index.is_complete: time.sleep(0.1)"
+    )
+    gdb_session.send_key("Enter")
+
+
+def test_symbol_index_loads_and_unloads_shards(gdb_session: GDBSession) -> None:
+    gdb_session.start([TEST_PROGRAM_C])
+    gdb_session.send_literal("set confirm off")
+    gdb_session.send_key("Enter")
+    gdb_session.send_literal(f"add-symbol-file {TEST_PROGRAM_CPP} -o 0x100000")
+    gdb_session.send_key("Enter")
+    _wait_for_symbol_index(gdb_session)
+    pane_content = _run_python(
+        gdb_session,
+        "SYMBOL_INDEX_MANAGER.index.complete('testi'), SYMBOL_INDEX_MANAGER.index.complete('multipl')",
+    )
+    assert b"(['foo::B::testing()'], ['multiply'])" in pane_content
+
+    # The shard of the C++ program is dropped, the shard of the C program stays
+    gdb_session.send_literal(f"remove-symbol-file {TEST_PROGRAM_CPP}")
+    gdb_session.send_key("Enter")
+    _wait_for_symbol_index(gdb_session)
+    pane_content = _run_python(
+        gdb_session,
+        "SYMBOL_INDEX_MANAGER.index.complete('testi'), SYMBOL_INDEX_MANAGER.index.complete('multipl')",
+    )
+    assert b"([], ['multiply'])" in pane_content